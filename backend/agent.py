@@ -1,26 +1,37 @@
 import os
-from typing import List, Optional
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from langchain_openai import OpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain_pinecone import PineconeVectorStore
-from langchain_openai import OpenAIEmbeddings
-import pinecone
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
 import datetime
 import re
-import dateparser
+import asyncio
+import queue
 import threading
-from langchain.agents import initialize_agent, Tool
-from dateparser.search import search_dates
-from appointments import get_available_slots, get_slots_by_specialty, get_specialty_recommendation, format_slots_for_display, book_appointment, get_booking_confirmation_message
-import string
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextvars
+from contextvars import ContextVar
+from langchain.agents import AgentExecutor, Tool, create_openai_functions_agent
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from date_extraction import extract_date, extract_date_range
+from intent_classifier import message_classifier, severity_classifier
+from followup_scheduler import followup_broker, followup_scheduler
+from session_store import SessionLock, UserSession, create_session_store
+from appointments import get_available_slots, get_slots_by_specialty, get_specialty_recommendation, format_slots_for_display, display_order, book_appointment, book_slot, get_booking_confirmation_message
+from health_retriever import health_retriever, record_text
+from vitals_store import vitals_store
 
 # --- System prompt for all agent responses ---
+# Identical for every user and turn so the provider can cache it as a prompt prefix;
+# the user's name, the date and per-turn facts follow it in later messages.
 SYSTEM_PROMPT = """
 You are an intelligent and empathetic AI health assistant named CareMate, designed to help elderly users manage their daily wellbeing. Your goal is to assist users in a calm, human-like, and emotionally supportive manner, using only the tools and context provided to you.
 
-IMPORTANT: You are talking to {name}. Always address them by their name when appropriate. Use their name naturally in your responses for empathy, emphasis, or clarification.
+IMPORTANT: You are talking to the user named in the SESSION section that follows these instructions. Always address them by their name when appropriate. Use their name naturally in your responses for empathy, emphasis, or clarification.
 
 Your primary responsibility is to interpret the user's message, determine the intent or concern, and respond accordingly using available tools and facts.
 
@@ -50,7 +61,7 @@ DATE-AWARE HEALTH DATA RETRIEVAL (RAG):
 - If the user mentions a date (e.g., “yesterday”, “July 14”), convert it to `YYYY-MM-DD`.
 - If no date is mentioned, call `get_current_date()` to use today’s date.
 - Always add this date in the metadata filter like:
-  {{"user_id": "user_john", "data_type": "vitals", "timestamp": "2025-07-15"}}
+  {"user_id": "user_john", "data_type": "vitals", "timestamp": "2025-07-15"}
 - Only return data that matches that date exactly.
 
 ---
@@ -67,7 +78,7 @@ TOOLS AVAILABLE TO YOU:
    - Get today’s date
 
 3. User Name Tool — `get_user_name()`
-   - Get the current user's name ({name})
+   - Get the current user's name (also given in the SESSION section)
 
 4. get_appointments(specialty, week_range) – Retrieves available doctors and appointment slots for the week, based on the medical specialty needed.
 
@@ -135,8 +146,8 @@ Mild Case:
 User: I feel dizzy and light-headed this morning.
 
 Agent Process:
-get_rag_context("user_mary", {{"data_type": "food", "timestamp": "2025-07-15"}}) → skipped dinner  
-get_rag_context("user_mary", {{"data_type": "vitals", "timestamp": "2025-07-15"}}) → normal heart rate
+get_rag_context("user_mary", {"data_type": "food", "timestamp": "2025-07-15"}) → skipped dinner  
+get_rag_context("user_mary", {"data_type": "vitals", "timestamp": "2025-07-15"}) → normal heart rate
 
 Agent Response:
 Based on your meals, vitals, and health records, this appears to be a mild issue. Try drinking some water and having a small meal. I’ll check back with you in 5 minutes. (Reminder: Follow up with Mary in 5 minutes)
@@ -147,7 +158,7 @@ Serious Case:
 User: My chest feels tight and I'm struggling to breathe.
 
 Agent Process:
-get_rag_context("user_john", {{"data_type": "medical_record", "timestamp": "2025-07-15"}}) → history of arrhythmia
+get_rag_context("user_john", {"data_type": "medical_record", "timestamp": "2025-07-15"}) → history of arrhythmia
 
 Agent Response:
 Given your medical history and symptoms, this may be serious. Would you like me to call 911 and notify your emergency contacts?  
@@ -159,126 +170,267 @@ RESTRICTIONS:
 - Never fabricate or assume answers
 - Do not mix dates unless explicitly asked
 - Be clear, safe, and helpful always
-
-(Current date: {date}, User: {name})
 """
 
+# Per-user section, sent right after the static prompt and before the chat history
+SESSION_PROMPT = """SESSION:
+User: {name}
+Current date: {date}"""
+
+# Per-turn facts (RAG results, appointment hints), sent after the chat history
+TURN_CONTEXT_PROMPT = """CONTEXT FOR THIS TURN:
+{extra_context}"""
+
 from langchain_openai import ChatOpenAI
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.4)
-# Create a dictionary to store separate memory instances for each user
-user_memories = {}
-# Store pending follow-up messages for each user
-pending_followups = {}
-emergency_states = {}
-
-pending_appointment = {}  # user_id -> {'slot_number': int, 'slot_details': dict, 'reason': str, 'summary': str}
-pending_slots = {}  # user_id -> list of slots last shown
-
-PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
-PINECONE_ENV = os.environ.get("PINECONE_ENVIRONMENT")
-pc = None
-index = None
-
-def get_pinecone_index():
-    global pc, index
-    if pc is None and PINECONE_API_KEY and PINECONE_ENV:
-        try:
-            pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
-            INDEX_NAME = "elderly-health-agent"
-            index = pc.Index(INDEX_NAME)
-        except Exception as e:
-            print(f"Warning: Could not initialize Pinecone: {e}")
-            pc = None
-            index = None
-    return index
+
+# Raw "usage" block of the streamed completion running in this context, filled in by _UsageTap
+_raw_stream_usage: ContextVar[Optional[Dict]] = ContextVar("raw_stream_usage", default=None)
+
+class _UsageTap:
+    """Wraps an OpenAI completions client and keeps the raw usage from streamed responses.
+
+    langchain-openai 0.1.x turns the final streamed usage chunk into usage_metadata with
+    input/output totals only, dropping prompt_tokens_details.cached_tokens.
+    """
+
+    def __init__(self, completions):
+        self._completions = completions
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+    def create(self, **payload):
+        response = self._completions.create(**payload)
+        if not payload.get("stream"):
+            return response
+        if asyncio.iscoroutine(response):
+            return self._acreate(response)
+        return _TappedStream(response)
+
+    async def _acreate(self, response):
+        return _TappedStream(await response)
+
+class _TappedStream:
+    """A sync or async OpenAI stream that records each chunk's usage as it passes"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _record(self, chunk):
+        raw_usage = _raw_stream_usage.get()
+        if raw_usage is not None and getattr(chunk, "usage", None) is not None:
+            raw_usage.update(chunk.usage.model_dump())
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stream.__exit__(*exc_info)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self._stream.__aexit__(*exc_info)
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+
+class UsageReportingChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose streamed replies carry the raw OpenAI usage (cached prompt tokens
+    included) in response_metadata["token_usage"], like non-streamed replies do in llm_output.
+
+    This relies on langchain-openai calling client.create() and iterating the stream it
+    returns, so openai and langchain-openai are pinned; test_usage_logging.py fails if
+    an upgrade changes that.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if callable(getattr(self.client, "create", None)) and callable(getattr(self.async_client, "create", None)):
+            self.client = _UsageTap(self.client)
+            self.async_client = _UsageTap(self.async_client)
+        else:
+            print("[WARNING] Unexpected OpenAI client layout; cached prompt tokens won't be logged")
+
+    @staticmethod
+    def _attach_usage(chunk, raw_usage: Dict):
+        if raw_usage and chunk.message.usage_metadata:
+            chunk.message.response_metadata["token_usage"] = dict(raw_usage)
+            raw_usage.clear()
+
+    def _stream(self, *args, **kwargs):
+        raw_usage = {}
+        _raw_stream_usage.set(raw_usage)
+        for chunk in super()._stream(*args, **kwargs):
+            self._attach_usage(chunk, raw_usage)
+            yield chunk
+
+    async def _astream(self, *args, **kwargs):
+        raw_usage = {}
+        _raw_stream_usage.set(raw_usage)
+        async for chunk in super()._astream(*args, **kwargs):
+            self._attach_usage(chunk, raw_usage)
+            yield chunk
+
+llm = UsageReportingChatOpenAI(model="gpt-4o-mini", temperature=0.4)
+# Recent turns kept verbatim per user; older ones are folded into a running summary
+MEMORY_MAX_TOKENS = int(os.environ.get("MEMORY_MAX_TOKENS", "1200"))
+
+# Health data types pulled for symptom messages; these are fetched by vector ID
+HEALTH_DATA_TYPES = ("food", "vitals", "medical_record")
+RAG_LOOKUP_TIMEOUT = float(os.environ.get("RAG_LOOKUP_TIMEOUT", "8"))
+RAG_MAX_WORKERS = int(os.environ.get("RAG_MAX_WORKERS", "8"))
+_rag_executor = ThreadPoolExecutor(max_workers=RAG_MAX_WORKERS, thread_name_prefix="rag-lookup")
+
+# Per-request values (user_id, message) that the shared tools read instead of closing over them
+_current_request: ContextVar[Dict] = ContextVar("current_request", default={})
 
 def get_current_date(query=None):
     if not query or query.strip().lower() in ["today", "date", "current date", "day"]:
         dt_obj = datetime.date.today()
     else:
-        dt_obj = dateparser.parse(query, settings={'RELATIVE_BASE': datetime.datetime.now()})
-        if not dt_obj:
-            dt_obj = datetime.date.today()
+        date_str = extract_date(query)
+        dt_obj = datetime.date.fromisoformat(date_str) if date_str else datetime.date.today()
     # Format as: Monday, July 14, 2025
     return dt_obj.strftime("%A, %B %d, %Y")
 
 def _infer_data_type_from_query(q: str) -> Optional[str]:
-    q_lower = q.lower()
-    if any(word in q_lower for word in ["food", "meal", "diet", "breakfast", "lunch", "dinner"]):
-        return "food"
-    if any(word in q_lower for word in ["vitals", "heart", "blood pressure", "oxygen", "pulse", "steps", "step count"]):
-        return "vitals"
-    if any(word in q_lower for word in ["medical", "diagnosis", "record", "history", "prescribed", "medication"]):
-        return "medical_record"
+    intents = message_classifier.classify(q)
+    for data_type in ("food", "vitals", "medical_record"):
+        if intents.has(data_type):
+            return data_type
     return None
 
 def _extract_date_from_query(q: str) -> Optional[str]:
     """Return a YYYY-MM-DD string if a date-like expression is found in the query."""
-    # First try search_dates to find any date expression in the sentence
-    results = search_dates(q, settings={'RELATIVE_BASE': datetime.datetime.now()})
-    if results:
-        for txt, dt in results:
-            txt_l = txt.lower().strip()
-            # Accept if the match contains any digit OR clearly date-related keywords
-            if any(ch.isdigit() for ch in txt) or any(k in txt_l for k in [
-                "yesterday", "today", "tomorrow", "last", "ago", "week", "month", "year"]):
-                return dt.strftime('%Y-%m-%d')
-    # Fallback to direct parse of the whole query only if query itself hints at a date
-    date_keywords = [
-        "yesterday", "today", "tomorrow", "last", "ago", "week", "month", "year",
-        "jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec",
-        "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
-        "january", "february", "march", "april", "june", "july", "august", "september", "october", "november", "december"
-    ]
-    if any(ch.isdigit() for ch in q) or any(k in q.lower() for k in date_keywords):
-        dt = dateparser.parse(q, settings={'RELATIVE_BASE': datetime.datetime.now()})
-        if dt:
-            return dt.strftime('%Y-%m-%d')
-    return None
-
+    return extract_date(q)
+
+def _extract_date_range_from_query(q: str) -> Optional[Tuple[str, str]]:
+    """Return inclusive (start, end) YYYY-MM-DD strings if the query asks about a span of days."""
+    return extract_date_range(q)
+
+def _range_context(query: str, user_id: str, data_type: Optional[str], start_date: str, end_date: str) -> str:
+    """Health data for a span of days from one range-filtered lookup, one block per day"""
+    if data_type == "vitals":
+        stored = vitals_store.describe_range(user_id, start_date, end_date)
+        if stored:
+            return f"Vitals from {start_date} to {end_date}:\n{stored}"
+    if not health_retriever.is_available():
+        return f"No Pinecone connection available. Please check your API keys."
+    grouped = health_retriever.search_range(query, user_id, start_date, end_date, [data_type] if data_type else None)
+    if not grouped:
+        return f"No health data found between {start_date} and {end_date}."
+    blocks = []
+    for day, docs in grouped.items():
+        lines = "\n".join(f"- {doc.metadata.get('data_type', 'record')}: {doc.page_content}" for doc in docs)
+        blocks.append(f"{day}:\n{lines}")
+    return "\n".join(blocks)
 
 def get_rag_context_tool(query, user_id):
-    pinecone_index = get_pinecone_index()
-    if not pinecone_index:
-        return f"No Pinecone connection available. Please check your API keys."
-    
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    vectorstore = PineconeVectorStore(
-        index=pinecone_index,
-        embedding=embeddings,
-        text_key="text",
-        index_name="elderly-health-agent"
-    )
+    data_type = _infer_data_type_from_query(query)
+    date_range = _extract_date_range_from_query(query)
+    if date_range:
+        return _range_context(query, user_id, data_type, *date_range)
+
     date_str = _extract_date_from_query(query)
     if not date_str:
         date_str = datetime.date.today().strftime('%Y-%m-%d')
 
-    data_type = _infer_data_type_from_query(query)
-    metadata_filter = {
-        "user_id": {"$eq": user_id},
-        "date": {"$eq": date_str}
-    }
-    if data_type:
-        metadata_filter["data_type"] = {"$eq": data_type}
+    if data_type == "vitals":
+        # Numeric vitals come straight from the columnar store when it has the day
+        stored = vitals_store.describe_day(user_id, date_str)
+        if stored:
+            return stored
+
+    if not health_retriever.is_available():
+        return f"No Pinecone connection available. Please check your API keys."
 
-    retriever = vectorstore.as_retriever(
-        search_kwargs={
-            "k": 5,
-            "filter": metadata_filter
+    if data_type:
+        # Exact (user, date, type) key: fetch the ingested record by ID, no embedding needed
+        docs = health_retriever.fetch_day(user_id, date_str, [data_type])[data_type]
+        if docs:
+            return record_text(docs)
+    else:
+        metadata_filter = {
+            "user_id": {"$eq": user_id},
+            "date": {"$eq": date_str}
         }
-    )
-    docs = retriever.get_relevant_documents(query)
-    if docs:
-        return docs[0].page_content
+        docs = health_retriever.search(query, metadata_filter, k=5)
+        if docs:
+            return docs[0].page_content
     return f"No health data found for {date_str}."
 
+def _lookup_health_day(user_id: str, date_str: str, data_types: List[str]):
+    """Known data types are fetched by ID; anything else falls back to one semantic search"""
+    known = [data_type for data_type in data_types if data_type in HEALTH_DATA_TYPES]
+    unknown = [data_type for data_type in data_types if data_type not in HEALTH_DATA_TYPES]
+    grouped = health_retriever.fetch_day(user_id, date_str, known) if known else {}
+    if unknown:
+        query = " ".join(unknown) + f" {date_str}"
+        grouped.update(health_retriever.search_day(query, user_id, date_str, unknown))
+    return grouped
+
+def fetch_health_context(user_id: str, date_str: str, data_types: Iterable[str] = None, timeout: float = None) -> Dict[str, str]:
+    """Look up several health data types for one day in a single retrieval round trip.
+
+    Returns {data_type: text} for every requested type. Vitals are read from the columnar
+    vitals store when it has the day, skipping retrieval for them. The lookup runs on the shared
+    pool with a timeout; if it fails or times out every type gets a placeholder, and
+    types with no stored record get the usual "No health data found" message.
+    """
+    data_types = list(data_types or HEALTH_DATA_TYPES)
+    timeout = RAG_LOOKUP_TIMEOUT if timeout is None else timeout
+    results = {}
+    if "vitals" in data_types:
+        stored = vitals_store.describe_day(user_id, date_str)
+        if stored:
+            results["vitals"] = stored
+    remaining = [data_type for data_type in data_types if data_type not in results]
+    if not remaining:
+        return results
+    if not health_retriever.is_available():
+        results.update({data_type: "No Pinecone connection available. Please check your API keys." for data_type in remaining})
+        return results
+
+    future = _rag_executor.submit(_lookup_health_day, user_id, date_str, remaining)
+    try:
+        grouped = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        print(f"[WARNING] Health context lookup for {user_id} on {date_str} timed out after {timeout}s")
+        grouped = None
+    except Exception as e:
+        print(f"[WARNING] Health context lookup for {user_id} on {date_str} failed: {e}")
+        grouped = None
+
+    for data_type in remaining:
+        if grouped is None:
+            results[data_type] = f"Health data for {date_str} is temporarily unavailable."
+        elif grouped.get(data_type):
+            # Known types are whole records fetched by ID, the rest ranked search results
+            docs = grouped[data_type]
+            results[data_type] = record_text(docs) if data_type in HEALTH_DATA_TYPES else docs[0].page_content
+        else:
+            results[data_type] = f"No health data found for {date_str}."
+    return results
+
 def get_user_name(user_id: str):
     """Extract user name from user_id"""
     if user_id and user_id.startswith("user_"):
         return user_id.replace("user_", "").capitalize()
     return "User"
 
-def get_appointments_tool(specialty: str, week_range: str, current_message: str, user_id: str = None):
+def get_appointments_tool(specialty: str, week_range: str, current_message: str, user_id: str = None,
+                          session: UserSession = None):
     """Get available appointments - show all slots for user to choose from"""
     all_slots = get_available_slots()
     # Determine if we should filter by specialty
@@ -287,13 +439,15 @@ def get_appointments_tool(specialty: str, week_range: str, current_message: str,
         slots = get_slots_by_specialty(specialty)
     else:
         slots = all_slots
-    # Always store the shown slots for this user
-    if user_id:
-        pending_slots[user_id] = slots
+    # Always store the shown slots for this user, numbered as displayed
+    slots = display_order(slots)
+    if session is not None:
+        session.pending_slots = slots
         print(f"[DEBUG] Set pending_slots for user {user_id}: {[f'{s['doctor']} {s['date']} {s['time']}' for s in slots]}")
     return format_slots_for_display(slots)
 
-def book_appointment_tool(slot_number: str, reason: str, user_id: str, current_message: str):
+def book_appointment_tool(slot_number: str, reason: str, user_id: str, current_message: str,
+                          session: UserSession = None):
     """Book an appointment by slot number"""
     try:
         slot_num = int(slot_number) if slot_number else 1
@@ -302,12 +456,15 @@ def book_appointment_tool(slot_number: str, reason: str, user_id: str, current_m
         # If no reason provided, try to extract from message
         if not reason:
             # Extract symptoms from current message
-            symptom_keywords = ["pain", "hurt", "ache", "dizzy", "tight", "pressure", "nausea", "breath", "faint", "bleeding", "vomit", "palpitation", "arrhythmia", "cramp", "chest", "heart", "headache", "memory", "nerve", "stroke", "seizure", "mobility", "balance", "fall", "chronic", "diabetes"]
-            found_symptoms = [word for word in symptom_keywords if word in current_message.lower()]
+            found_symptoms = message_classifier.classify(current_message).keywords("booking_symptom")
             reason = f"Patient reported: {', '.join(found_symptoms)}" if found_symptoms else "General consultation"
         
-        # Book the appointment
-        result = book_appointment(slot_num, patient_name, reason, user_id)
+        # Book the appointment; the number refers to the list last shown to the user when there is one
+        shown = session.pending_slots if session is not None else None
+        if shown and 1 <= slot_num <= len(shown):
+            result = book_slot(shown[slot_num - 1]["slot_id"], patient_name, reason, user_id)
+        else:
+            result = book_appointment(slot_num, patient_name, reason, user_id)
         
         if result["success"]:
             return get_booking_confirmation_message(result["booking"])
@@ -318,26 +475,30 @@ def book_appointment_tool(slot_number: str, reason: str, user_id: str, current_m
         return "Please provide a valid slot number to book an appointment."
 
 def set_pending_for_direct_slot(user_id, slot_details, summary):
-    pending_slots[user_id] = [slot_details]
-    pending_appointment[user_id] = {
+    session = session_store.load(user_id)
+    session.pending_slots = [slot_details]
+    session.pending_appointment = {
         'slot_number': 1,
         'slot_details': slot_details,
         'reason': summary,
         'summary': summary
     }
+    session_store.save(user_id, session)
     print(f"[DEBUG] Set pending_appointment and pending_slots for user {user_id} (direct slot): {slot_details['doctor']} {slot_details['date']} {slot_details['time']}")
 
-def build_tools(user_id, current_message: str):
-    """Return the list of tools, ensuring get_rag_context_tool receives the full user message for correct date parsing."""
-    name = get_user_name(user_id)
+def _request_value(key: str) -> Optional[str]:
+    return _current_request.get().get(key)
 
+def build_tools():
+    """Return the list of tools. They take the user and the full user message from the current request,
+    so one set serves every request; get_rag_context uses the message for correct date parsing."""
     return [
         Tool(
             name="get_rag_context",
             # We ignore the LLM-provided query (`q`) and instead use the full user message so
             # that date and data-type inference is always accurate.
-            func=lambda q=None: get_rag_context_tool(current_message, user_id=user_id),
-            description="Retrieve health data (food, vitals, medical_record) for the user. Automatically infers date and data type from the current question. Use this to answer any question about the user's health, diet, vitals, or medical history. If user has any problem with thier health use this data to understand and give your prediction on if its mild or serious as well.Alwasys use todays date for the data retrieval unless user specifies yesterday or any other day for prediction of symptoms"
+            func=lambda q=None: get_rag_context_tool(_request_value("message"), user_id=_request_value("user_id")),
+            description="Retrieve health data (food, vitals, medical_record) for the user. Automatically infers date and data type from the current question. Use this to answer any question about the user's health, diet, vitals, or medical history. If user has any problem with thier health use this data to understand and give your prediction on if its mild or serious as well.Alwasys use todays date for the data retrieval unless user specifies yesterday or any other day for prediction of symptoms. Ranges such as 'last week' or 'since Monday' return one block per day."
         ),
         Tool(
             name="get_current_date",
@@ -346,91 +507,399 @@ def build_tools(user_id, current_message: str):
         ),
         Tool(
             name="get_user_name",
-            func=lambda x: name,
+            func=lambda x=None: get_user_name(_request_value("user_id")),
             description="Get the current user's name."
         ),
         Tool(
             name="get_appointments",
-            func=lambda specialty=None, week_range=None: get_appointments_tool(specialty, week_range, current_message, user_id),
+            func=lambda specialty=None, week_range=None: get_appointments_tool(specialty, week_range, _request_value("message"), _request_value("user_id"), _request_value("session")),
             description="Show all available appointment slots for the user to choose from. If user mentions a specific specialty (e.g., 'cardiology', 'neurology'), filter by that specialty. Otherwise, show all available slots across all specialties."
         ),
         Tool(
             name="book_appointment",
-            func=lambda slot_number=None, reason=None: book_appointment_tool(slot_number, reason, user_id, current_message),
+            func=lambda slot_number=None, reason=None: book_appointment_tool(slot_number, reason, _request_value("user_id"), _request_value("message"), _request_value("session")),
             description="Book an appointment by slot number. Use this after showing available slots with get_appointments. The slot_number should be the number from the displayed list."
         )
     ]
 
+class PromptUsageLogger(BaseCallbackHandler):
+    """Logs prompt, cached-prompt and completion tokens for each LLM call in a request"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        # The agent always streams, so usage comes on the final message; non-streamed calls report it in llm_output
+        message = getattr(response.generations[0][0], "message", None) if response.generations and response.generations[0] else None
+        usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") \
+            or (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens") or 0
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+            completion_tokens = usage.get("completion_tokens") or 0
+        else:
+            metadata = getattr(message, "usage_metadata", None) or {}
+            prompt_tokens = metadata.get("input_tokens") or 0
+            cached_tokens = (metadata.get("input_token_details") or {}).get("cache_read") or 0
+            completion_tokens = metadata.get("output_tokens") or 0
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += completion_tokens
+        print(f"[DEBUG] LLM call for {self.user_id}: prompt_tokens={prompt_tokens} cached_tokens={cached_tokens} completion_tokens={completion_tokens}")
+
+    def summary(self) -> str:
+        hit_rate = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (
+            f"{self.calls} LLM calls, prompt_tokens={self.prompt_tokens} cached_tokens={self.cached_tokens} "
+            f"({hit_rate:.0%} cached), completion_tokens={self.completion_tokens}"
+        )
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Puts each non-empty streamed LLM token on a queue for agent_response_stream"""
+
+    def __init__(self, tokens: "queue.Queue[Optional[str]]"):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.tokens.put(token)
+
+class AsyncTokenQueueHandler(AsyncCallbackHandler):
+    """Async counterpart of TokenQueueHandler for agent_response_astream"""
+
+    def __init__(self, tokens: "asyncio.Queue[Optional[str]]"):
+        self.tokens = tokens
+
+    async def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            await self.tokens.put(token)
+
+_agent_executor: Optional[AgentExecutor] = None
+_agent_executor_lock = threading.Lock()
+
+def get_agent_executor() -> AgentExecutor:
+    """Build the tool-calling agent once per process.
+
+    The prompt runs from most to least stable so provider-side prefix caching covers as
+    much as possible: static SYSTEM_PROMPT, SESSION_PROMPT (user, date), chat history,
+    then per-turn context and the message. Everything after the static prompt comes from
+    the invoke() inputs, and memory is read and saved by agent_response rather than
+    bound to the executor.
+
+    AgentExecutor streams every LLM call, whether or not the caller streams the reply, so
+    the model asks for usage in the stream (stream_usage) for PromptUsageLogger to read.
+    """
+    global _agent_executor
+    if _agent_executor is None:
+        with _agent_executor_lock:
+            if _agent_executor is None:
+                tools = build_tools()
+                prompt = ChatPromptTemplate.from_messages([
+                    SystemMessage(content=SYSTEM_PROMPT),
+                    ("system", SESSION_PROMPT),
+                    MessagesPlaceholder("chat_history"),
+                    MessagesPlaceholder("turn_context", optional=True),
+                    ("human", "{input}"),
+                    MessagesPlaceholder("agent_scratchpad"),
+                ])
+                agent = create_openai_functions_agent(llm.bind(stream_usage=True), tools, prompt)
+                _agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    return _agent_executor
+
 def schedule_followup(user_id: str, user_name: str = None):
+    """Queue the 5-minute symptom check-in; a check-in already pending for the user absorbs this one"""
     def followup():
         name = user_name or user_id.replace("user_", "").capitalize()
         followup_message = f"Hi {name}, it's been 5 minutes since you mentioned feeling unwell. How are you feeling now? Are your symptoms better, worse, or the same?"
         print(f"[FOLLOW-UP] Checking in with {user_id} after 5 minutes.")
         
-        # Store the follow-up message for the user
-        if user_id not in pending_followups:
-            pending_followups[user_id] = []
-        pending_followups[user_id].append(followup_message)
-        
-    timer = threading.Timer(300, followup)  # 300 seconds = 5 minutes
-    timer.start()
+        # Store the follow-up message for the user and wake any open follow-up stream
+        session_store.push_followup(user_id, followup_message)
+        followup_broker.notify(user_id)
+
+    if not followup_scheduler.schedule(user_id, "symptom_check", followup):
+        print(f"[DEBUG] Symptom check-in already pending for {user_id}; not scheduling another")
 
 def get_pending_followups(user_id: str):
     """Get and clear pending follow-up messages for a user"""
-    if user_id in pending_followups and pending_followups[user_id]:
-        messages = pending_followups[user_id].copy()
-        pending_followups[user_id] = []  # Clear the messages
-        return messages
-    return []
+    return session_store.pop_followups(user_id)
+
+class DeferredSummaryBufferMemory(ConversationSummaryBufferMemory):
+    """ConversationSummaryBufferMemory whose save_context only records the turn.
+
+    Folding old turns into the summary costs an LLM call, so compact_memory() does it once
+    the reply is out, without holding the user's session lock during the call.
+    """
+
+    def save_context(self, inputs: Dict, outputs: Dict[str, str]) -> None:
+        BaseChatMemory.save_context(self, inputs, outputs)
+
+    async def asave_context(self, inputs: Dict, outputs: Dict[str, str]) -> None:
+        await BaseChatMemory.asave_context(self, inputs, outputs)
+
+    def overflow(self) -> int:
+        """How many of the oldest messages must go into the summary to get under max_token_limit"""
+        messages = self.chat_memory.messages
+        count = 0
+        while count < len(messages) and self.llm.get_num_tokens_from_messages(messages[count:]) > self.max_token_limit:
+            count += 1
+        return count
+
+def new_user_memory() -> DeferredSummaryBufferMemory:
+    """Token-bounded chat history: only real user/assistant turns go in, the name and date live in the system prompt"""
+    return DeferredSummaryBufferMemory(
+        llm=llm,
+        memory_key="chat_history",
+        input_key="input",
+        output_key="output",
+        return_messages=True,
+        max_token_limit=MEMORY_MAX_TOKENS,
+    )
 
-def normalize_confirmation(msg):
-    msg = msg.strip().lower().strip(string.punctuation)
-    return msg
+# Per-user sessions (memory, greeting, emergency and pending booking state), see SESSION_STORE_BACKEND
+session_store = create_session_store(new_user_memory)
+
+# Summaries of old turns are written here, off the request path; one pending job per user
+_memory_compactor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-compactor")
+_compacting: set = set()
+_compacting_lock = threading.Lock()
+
+def schedule_memory_compaction(user_id: str):
+    with _compacting_lock:
+        if user_id in _compacting:
+            return
+        _compacting.add(user_id)
+    _memory_compactor.submit(_compact_memory_job, user_id)
+
+def _compact_memory_job(user_id: str):
+    try:
+        compact_memory(user_id)
+    except Exception as e:
+        print(f"[WARNING] Could not summarise old turns for {user_id}: {e}")
+    finally:
+        with _compacting_lock:
+            _compacting.discard(user_id)
+
+def _message_keys(messages) -> List[Tuple[str, str]]:
+    return [(message.type, message.content) for message in messages]
+
+def compact_memory(user_id: str):
+    """Fold the user's oldest turns into the running summary once the history is over
+    MEMORY_MAX_TOKENS. The session lock is released during the summarising LLM call; the
+    result is applied only if those turns are still the oldest and the summary is
+    unchanged (no new session or other compaction meanwhile), else the next turn retries."""
+    lock = session_store.lock(user_id)
+    try:
+        memory = session_store.load(user_id).memory
+        count = memory.overflow()
+        if not count:
+            return
+        pruned = list(memory.chat_memory.messages[:count])
+        summary = memory.moving_summary_buffer
+    finally:
+        lock.release()
+
+    new_summary = memory.predict_new_summary(pruned, summary)
+
+    lock = session_store.lock(user_id)
+    try:
+        session = session_store.load(user_id)
+        memory = session.memory
+        messages = memory.chat_memory.messages
+        if memory.moving_summary_buffer != summary or _message_keys(messages[:count]) != _message_keys(pruned):
+            return
+        del messages[:count]
+        memory.moving_summary_buffer = new_summary
+        session_store.save(user_id, session)
+    finally:
+        lock.release()
+    print(f"[DEBUG] Folded {count} old messages into the summary for {user_id}")
+
+class AgentTurn:
+    """State carried from prepare_turn() through the LLM call to finish_turn()"""
+
+    def __init__(self, message: str, user_id: str, name: str, today: str, intents, session: UserSession,
+                 extra_context: str, symptom_facts: Optional[str]):
+        self.message = message
+        self.user_id = user_id
+        self.name = name
+        self.today = today
+        self.intents = intents
+        self.session = session
+        self.memory = session.memory
+        self.extra_context = extra_context
+        self.symptom_facts = symptom_facts
+        self.lock = SessionLock()  # the user's session lock, held until finish_turn()
 
 def agent_response(message: str, user_id: str = None) -> str:
+    turn = prepare_turn(message, user_id)
+    if isinstance(turn, str):
+        return turn
+    try:
+        return finish_turn(turn, run_agent(turn))
+    finally:
+        turn.lock.release()
+
+def agent_response_stream(message: str, user_id: str = None) -> Iterator[Dict[str, str]]:
+    """Like agent_response, but yields events as the reply is produced.
+
+    {"event": "token", "text": ...} events carry the symptom facts and then LLM tokens as
+    they arrive. The last event is {"event": "final", "response": ...} with the complete
+    reply after the safety post-processing (follow-up, emergency question), which the
+    client should show in place of the streamed text.
+    """
+    turn = prepare_turn(message, user_id)
+    if isinstance(turn, str):
+        yield {"event": "final", "response": turn}
+        return
+    # The symptom facts go through the token queue so nothing is yielded before the worker
+    # owns the turn; a client gone at the first token can't leave the session locked
+    tokens: "queue.Queue[Optional[str]]" = queue.Queue()
+    if turn.symptom_facts:
+        tokens.put(turn.symptom_facts)
+    result = {}
+
+    def run():
+        # The worker finishes the turn itself, so it is saved (and any follow-up scheduled)
+        # even if the client disconnects and this generator is closed mid-stream
+        try:
+            result["response"] = finish_turn(turn, run_agent(turn, callbacks=[TokenQueueHandler(tokens)]))
+        except Exception as e:
+            result["error"] = e
+        finally:
+            turn.lock.release()
+            tokens.put(None)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+    while True:
+        text = tokens.get()
+        if text is None:
+            break
+        yield {"event": "token", "text": text}
+    if "error" in result:
+        raise result["error"]
+    yield {"event": "final", "response": result["response"]}
+
+def _release_abandoned_turn(prepared: "asyncio.Future"):
+    if not prepared.cancelled() and prepared.exception() is None and isinstance(prepared.result(), AgentTurn):
+        # Releasing can be a SQLite write, so not on the event loop
+        prepared.get_loop().run_in_executor(None, prepared.result().lock.release)
+
+async def aprepare_turn(message: str, user_id: str = None) -> Union[str, AgentTurn]:
+    """prepare_turn in a worker thread. If the request is cancelled meanwhile, the thread
+    still runs to the end, so the session lock it takes is released once it does."""
+    prepared = asyncio.ensure_future(asyncio.to_thread(prepare_turn, message, user_id))
+    try:
+        return await asyncio.shield(prepared)
+    except asyncio.CancelledError:
+        prepared.add_done_callback(_release_abandoned_turn)
+        raise
+
+async def agent_response_async(message: str, user_id: str = None) -> str:
+    """agent_response for the ASGI server: the LLM calls are awaited, and the short
+    blocking steps (retrieval, memory updates) run in worker threads."""
+    turn = await aprepare_turn(message, user_id)
+    if isinstance(turn, str):
+        return turn
+    try:
+        output = await arun_agent(turn)
+        return await asyncio.to_thread(finish_turn, turn, output)
+    finally:
+        # A no-op unless arun_agent failed; otherwise a SQLite write, so off the event loop
+        await asyncio.to_thread(turn.lock.release)
+
+# Streamed turns still running after their client disconnected
+_unfinished_turns: set = set()
+
+async def agent_response_astream(message: str, user_id: str = None) -> AsyncIterator[Dict[str, str]]:
+    """Async counterpart of agent_response_stream, yielding the same events"""
+    turn = await aprepare_turn(message, user_id)
+    if isinstance(turn, str):
+        yield {"event": "final", "response": turn}
+        return
+    tokens: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    if turn.symptom_facts:
+        tokens.put_nowait(turn.symptom_facts)
+
+    async def run():
+        try:
+            output = await arun_agent(turn, callbacks=[AsyncTokenQueueHandler(tokens)])
+            return await asyncio.to_thread(finish_turn, turn, output)
+        finally:
+            await asyncio.to_thread(turn.lock.release)
+            await tokens.put(None)
+
+    # As in agent_response_stream, the task finishes the turn even if the client goes away
+    # mid-stream; it is shielded from this generator's cancellation and kept referenced until done
+    task = asyncio.create_task(run())
+    _unfinished_turns.add(task)
+    task.add_done_callback(_unfinished_turns.discard)
+    while True:
+        text = await tokens.get()
+        if text is None:
+            break
+        yield {"event": "token", "text": text}
+    yield {"event": "final", "response": await asyncio.shield(task)}
+
+def prepare_turn(message: str, user_id: str = None) -> Union[str, AgentTurn]:
+    """Everything before the LLM call.
+
+    Returns the reply itself (a string) when the turn is handled without the LLM: greeting,
+    appointment confirmation, slot selection and the emergency flow. The session is saved
+    then; otherwise it travels in the returned AgentTurn and finish_turn() saves it. The
+    user's session lock is taken here and released once the session is saved (or the turn
+    fails), so another worker's turn for the same user can't overwrite this one.
+    """
+    lock = session_store.lock(user_id)
+    try:
+        session = session_store.load(user_id)
+        turn = _prepare_turn(message, user_id, session)
+        if isinstance(turn, str):
+            session_store.save(user_id, session)
+        else:
+            turn.lock, lock = lock, None
+        return turn
+    finally:
+        if lock is not None:
+            lock.release()
+
+def _prepare_turn(message: str, user_id: str, session: UserSession) -> Union[str, AgentTurn]:
     print(f"[DEBUG] Incoming message: '{message}' | user_id: {user_id}")
     name = get_user_name(user_id)
     today = datetime.date.today().strftime("%B %d, %Y")
 
-    # Detect symptom keywords
-    symptom_keywords = [
-        "pain", "hurt", "ache", "dizzy", "dizziness", "light-headed", "lightheaded",
-        "tight", "pressure", "nausea", "breath", "breathing", "faint", "bleeding",
-        "vomit", "palpitation", "arrhythmia", "cramp", "chest", "heart"
-    ]
-    
-    # Detect appointment booking keywords
-    appointment_keywords = [
-        "appointment", "book", "schedule", "see doctor", "see a doctor", "make appointment",
-        "need to see", "want to see", "doctor visit", "medical appointment", "consultation"
-    ]
-    
-    # Detect slot selection keywords
-    slot_selection_keywords = [
-        "slot", "choose", "select", "want slot", "pick slot", "book slot", "number", "option"
-    ]
+    # One pass over the message finds every intent keyword (see intent_classifier.MESSAGE_KEYWORDS)
+    intents = message_classifier.classify(message)
 
     extra_context = ""
     symptom_facts = None
+    trend_date = None
     
     # Check for appointment booking intent FIRST (prioritize over symptom analysis)
-    appointment_intent = any(word in message.lower() for word in appointment_keywords)
-    slot_selection_intent = any(word in message.lower() for word in slot_selection_keywords) and any(char.isdigit() for char in message)
+    appointment_intent = intents.has("appointment")
+    slot_selection_intent = intents.has("slot_selection") and intents.has_digit
     
     # Only do symptom analysis if user is NOT requesting an appointment
-    if not appointment_intent and any(word in message.lower() for word in symptom_keywords):
+    if not appointment_intent and intents.has("symptom"):
         # Determine the date to use (parse from message or default today)
         date_str_symptom = _extract_date_from_query(message) or datetime.date.today().strftime('%Y-%m-%d')
-        # Fetch data for all three types
-        food_ctx = get_rag_context_tool(f"food {date_str_symptom}", user_id)
-        vitals_ctx = get_rag_context_tool(f"vitals {date_str_symptom}", user_id)
-        med_ctx = get_rag_context_tool(f"medical record {date_str_symptom}", user_id)
+        # Fetch data for all three types in one lookup
+        health_ctx = fetch_health_context(user_id, date_str_symptom)
+        food_ctx = health_ctx["food"]
+        vitals_ctx = health_ctx["vitals"]
+        med_ctx = health_ctx["medical_record"]
 
         extra_context = (
             f"\n\n---\nFood on {date_str_symptom}: {food_ctx}\n"
             f"Vitals on {date_str_symptom}: {vitals_ctx}\n"
             f"Medical record on {date_str_symptom}: {med_ctx}\n---\n"
         )
+        trend_date = date_str_symptom
         
         # Store a concise factual summary to prepend later (only for symptom messages)
         symptom_facts = (
@@ -440,6 +909,15 @@ def agent_response(message: str, user_id: str = None) -> str:
             f"• Medical record: {med_ctx}\n\n"
         )
     
+    if not appointment_intent and trend_date is None and intents.has("trend"):
+        trend_date = _extract_date_from_query(message) or datetime.date.today().strftime('%Y-%m-%d')
+
+    if trend_date:
+        # Rolling vitals stats are precomputed at ingest, so this is a lookup
+        trend_summary = vitals_store.describe_trends(user_id, trend_date)
+        if trend_summary:
+            extra_context += f"\n\n---\nVitals trends:\n{trend_summary}\n---\n"
+
     if appointment_intent:
         # Add appointment context to help the agent understand the intent
         extra_context += "\n\n---\nAPPOINTMENT BOOKING REQUEST DETECTED\n"
@@ -449,60 +927,42 @@ def agent_response(message: str, user_id: str = None) -> str:
         extra_context += "DO NOT call RAG or analyze symptoms - focus only on appointment booking.\n---\n"
     
     # Check for slot confirmation intent (yes/no)
-    norm_msg = normalize_confirmation(message)
-    confirmation_yes = norm_msg in ["yes", "y", "confirm", "ok", "okay", "s", "sure","yes sure", "Yes", "Yes.","yes."]
-    confirmation_no = norm_msg in ["no", "n", "not ok", "not okay"]
+    norm_msg = intents.normalized
+    confirmation_yes = intents.confirmation == "yes"
+    confirmation_no = intents.confirmation == "no"
 
 
     # Debug logging for confirmation
-    if user_id in pending_appointment:
+    if session.pending_appointment:
         print(f"[DEBUG] Pending appointment found for user: {user_id}")
         print(f"[DEBUG] User message for confirmation: '{message}' (normalized: '{norm_msg}')")
 
     # If user is confirming a pending appointment
-    if user_id in pending_appointment and confirmation_yes:
+    if session.pending_appointment and confirmation_yes:
         print(f"[DEBUG] Booking appointment for user: {user_id}")
-        slot_info = pending_appointment[user_id]
+        slot_info = session.pending_appointment
         slot_number = slot_info['slot_number']
         reason = slot_info['reason']
         summary = slot_info['summary']
-        # Map the selected slot from pending_slots to the global list
-        slots_list = pending_slots.get(user_id)
+        # The selected slot carries its slot_id, so it is booked directly
+        slots_list = session.pending_slots
         if not slots_list or slot_number < 1 or slot_number > len(slots_list):
-            del pending_appointment[user_id]
-            if user_id in pending_slots:
-                del pending_slots[user_id]
+            session.pending_appointment = None
+            session.pending_slots = None
             return "Sorry, that slot is no longer available. Please choose another."
         slot_details = slots_list[slot_number - 1]
-        all_slots = get_available_slots()
-        global_slot_index = None
-        for idx, slot in enumerate(all_slots):
-            if (
-                slot['date'] == slot_details['date'] and
-                slot['time'] == slot_details['time'] and
-                slot['doctor'] == slot_details['doctor']
-            ):
-                global_slot_index = idx + 1  # 1-based index for booking
-                break
-        if global_slot_index is None:
-            del pending_appointment[user_id]
-            if user_id in pending_slots:
-                del pending_slots[user_id]
-            return "Sorry, that slot is no longer available. Please choose another."
-        result = book_appointment(global_slot_index, get_user_name(user_id), summary, user_id)
-        del pending_appointment[user_id]
-        if user_id in pending_slots:
-            del pending_slots[user_id]
+        result = book_slot(slot_details['slot_id'], get_user_name(user_id), summary, user_id)
+        session.pending_appointment = None
+        session.pending_slots = None
         if result["success"]:
             return get_booking_confirmation_message(result["booking"])
         else:
             return result["message"]
     # If user declines the slot
-    if user_id in pending_appointment and confirmation_no:
+    if session.pending_appointment and confirmation_no:
         print(f"[DEBUG] User declined appointment for user: {user_id}")
-        del pending_appointment[user_id]
-        if user_id in pending_slots:
-            del pending_slots[user_id]
+        session.pending_appointment = None
+        session.pending_slots = None
         return "No problem. Please choose another slot number from the available appointments."
 
     # If user selects a slot, prompt for confirmation instead of booking
@@ -519,19 +979,19 @@ def agent_response(message: str, user_id: str = None) -> str:
         if slot_number is None:
             return "Please specify a valid slot number."
         # Use the last shown slots for this user
-        slots_list = pending_slots.get(user_id)
+        slots_list = session.pending_slots
         print(f"[DEBUG] Slot selection for user {user_id}: slot_number={slot_number}, pending_slots={[f'{s['doctor']} {s['date']} {s['time']}' for s in slots_list] if slots_list else None}")
         if not slots_list or slot_number < 1 or slot_number > len(slots_list):
             return f"Invalid slot number. Please choose between 1 and {len(slots_list) if slots_list else 0}."
         slot_details = slots_list[slot_number - 1]
         # Try to get recent symptom/vitals summary from memory
         summary = "General consultation"
-        if user_id in user_memories:
+        if session.memory.buffer:
             # Look for last symptom message and vitals
-            mem = user_memories[user_id].buffer
+            mem = session.memory.buffer
             last_symptom = None
             for m in reversed(mem):
-                if hasattr(m, 'content') and any(word in m.content.lower() for word in symptom_keywords):
+                if hasattr(m, 'content') and message_classifier.classify(m.content).has("symptom"):
                     last_symptom = m.content
                     break
             if last_symptom:
@@ -539,7 +999,7 @@ def agent_response(message: str, user_id: str = None) -> str:
                 vitals = get_rag_context_tool("vitals", user_id)
                 summary = f"Patient reported: {last_symptom}\nRecent vitals: {vitals}"
         # Store pending slot selection
-        pending_appointment[user_id] = {
+        session.pending_appointment = {
             'slot_number': slot_number,
             'slot_details': slot_details,
             'reason': summary,
@@ -554,25 +1014,20 @@ def agent_response(message: str, user_id: str = None) -> str:
     # Example: If message contains 'Would you like to book this appointment slot?' and a slot is in context, set pending
     # (This may require you to add this logic wherever you generate such a proposal in your agent code)
 
-    tools = build_tools(user_id, message)
-    system_prompt = extra_context + SYSTEM_PROMPT.format(name=name, date=today)
     
-    # Emergency state: track as dict with 'active' and 'reason'
-    if user_id not in emergency_states:
-        emergency_states[user_id] = {"active": False, "reason": None}
-
+    # Emergency state: tracked on the session as a dict with 'active' and 'reason'
     # If emergency is active, keep responses contextual and varied until cleared
-    if emergency_states[user_id]["active"]:
+    if session.emergency["active"]:
         # Clear emergency when user confirms help has arrived or they feel okay
-        if any(p in message.lower() for p in ["help arrived", "paramedics", "ambulance", "i'm fine", "i am fine", "feel better", "i'm okay", "im okay", "i feel okay"]):
-            emergency_states[user_id] = {"active": False, "reason": None}
+        if intents.has("emergency_clear"):
+            session.emergency = {"active": False, "reason": None}
             return (
                 f"I'm relieved help has arrived, {name}. I'm here if you need anything else or have questions while you recover."
             )
 
-        state = emergency_states[user_id]
+        state = session.emergency
         turn = state.get("turn", 0) + 1
-        state["turn"] = turn  # persist updated turn count
+        state["turn"] = turn  # persisted when the session is saved
         reason = state.get("reason", "your symptoms")
 
         if turn == 1:
@@ -598,55 +1053,36 @@ def agent_response(message: str, user_id: str = None) -> str:
                 "If anything gets worse, speak out so I can update emergency responders." 
             )
 
-    # Get or create memory for this specific user
-    if user_id not in user_memories:
-        user_memories[user_id] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        print(f"[DEBUG] Created new memory for user: {user_id}")
-    memory = user_memories[user_id]
-    print(f"[DEBUG] Using existing memory for user: {user_id}")
+    # The user's memory comes with the session
+    memory = session.memory
     print(f"[DEBUG] Current memory buffer length: {len(memory.buffer) if memory.buffer else 0}")
     
     # If this is a new session (empty message), clear the memory and start fresh
     if not message.strip():
         print(f"[DEBUG] New session detected for {name}, clearing memory")
-        memory.clear()
-        user_memories[user_id] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        memory = user_memories[user_id]
-        # Clear emergency state for new session
-        if user_id in emergency_states:
-            del emergency_states[user_id]
+        # Fresh memory, greeting and emergency state for the new session
+        session.reset_conversation(new_user_memory())
+        memory = session.memory
     
-    agent = initialize_agent(
-        tools,
-        llm,
-        agent="openai-functions",
-        verbose=True,
-        memory=memory,
-        system_prompt=system_prompt
-    )
-    # Greeting logic: only if memory is empty and last AI message is not a greeting
-    if not memory.buffer or (memory.buffer and not any('how are you feeling today' in m.content.lower() for m in memory.buffer if hasattr(m, 'content'))):
+    # Greeting logic: once per session
+    if not session.greeted:
         print(f"[DEBUG] Sending greeting to {name}")
-        memory.save_context({"input": "system"}, {"output": f"You are talking to {name}."})
+        session.greeted = True
         greeting = f"Hello {name}, how are you feeling today?"
         memory.save_context({"input": message}, {"output": greeting})
         print(f"[DEBUG] Memory buffer after greeting: {memory.buffer}")
         return greeting
     print(f"[DEBUG] Using normal conversation with memory. Memory buffer: {memory.buffer}")
     
-    # Add name context to memory if not already present
-    name_context = f"Remember, you are talking to {name}."
-    memory.save_context({"input": "context"}, {"output": name_context})
-    
     # Check if this is a response to emergency question BEFORE running agent
     previous_messages = memory.buffer if memory.buffer else []
     previous_has_emergency_question = any("emergency contact" in str(msg.content).lower() or "911" in str(msg.content).lower() for msg in previous_messages if hasattr(msg, 'content'))
     
     # Check if this is a response to emergency question
-    is_emergency_response = previous_has_emergency_question and ("yes" in message.lower() or "no" in message.lower())
+    is_emergency_response = previous_has_emergency_question and (intents.has("says_yes") or intents.has("says_no"))
     
     if is_emergency_response:
-        if "yes" in message.lower():
+        if intents.has("says_yes"):
             print(f"🚨 [EMERGENCY ALERT] User {name} (ID: {user_id}) has requested emergency assistance!")
             print(f"📞 [EMERGENCY] Calling 911 for {name}...")
             print(f"📍 [EMERGENCY] Sharing location with emergency services: 123 Main Street, Apartment 4B, Minneapolis, MN 55455")
@@ -677,17 +1113,74 @@ def agent_response(message: str, user_id: str = None) -> str:
                     reason = "a medical emergency"
             else:
                 reason = "a medical emergency"
-            emergency_states[user_id] = {"active": True, "reason": reason}
+            session.emergency = {"active": True, "reason": reason}
 
             emergency_response = f"\n\nI've called 911 and contacted your emergency contacts. Don't worry, {name}, I'm here with you. Help is on the way.\n\nWhile we wait for emergency services to arrive, try to stay calm and comfortable. Take slow, deep breaths. If you're able, sit or lie down in a comfortable position. I'll stay with you until help arrives."
             return emergency_response
-        elif "no" in message.lower():
+        elif intents.has("says_no"):
             print(f"[INFO] User declined emergency services for {name}, converting to mild with follow-up")
             followup_msg = f"I understand you don't want emergency services right now. I'll check back with you in 5 minutes to see how you're feeling. (Reminder: Follow up with {name} in 5 minutes)"
-            emergency_states[user_id] = {"active": False, "reason": None}
+            session.emergency = {"active": False, "reason": None}
             return followup_msg
-    
-    response = agent.run(message)
+
+    return AgentTurn(message, user_id, name, today, intents, session, extra_context, symptom_facts)
+
+def _agent_inputs(turn: AgentTurn) -> Dict:
+    extra_context = turn.extra_context.strip()
+    turn_context = [SystemMessage(content=TURN_CONTEXT_PROMPT.format(extra_context=extra_context))] if extra_context else []
+    return {
+        "input": turn.message,
+        "name": turn.name,
+        "date": turn.today,
+        "chat_history": turn.memory.load_memory_variables({})["chat_history"],
+        "turn_context": turn_context,
+    }
+
+def run_agent(turn: AgentTurn, callbacks: List[BaseCallbackHandler] = None) -> str:
+    """Run the shared agent executor for one turn and return its raw output"""
+    usage_logger = PromptUsageLogger(turn.user_id)
+    token = _current_request.set({"user_id": turn.user_id, "message": turn.message, "session": turn.session})
+    try:
+        output = get_agent_executor().invoke(
+            _agent_inputs(turn),
+            config={"callbacks": [usage_logger, *(callbacks or [])]},
+        )["output"]
+    finally:
+        _current_request.reset(token)
+    print(f"[DEBUG] Prompt usage for {turn.user_id}: {usage_logger.summary()}")
+    return output
+
+async def arun_agent(turn: AgentTurn, callbacks: List[BaseCallbackHandler] = None) -> str:
+    """run_agent with the LLM calls awaited; the sync tools run in worker threads with the request context"""
+    usage_logger = PromptUsageLogger(turn.user_id)
+    token = _current_request.set({"user_id": turn.user_id, "message": turn.message, "session": turn.session})
+    try:
+        result = await get_agent_executor().ainvoke(
+            _agent_inputs(turn),
+            config={"callbacks": [usage_logger, *(callbacks or [])]},
+        )
+    finally:
+        _current_request.reset(token)
+    print(f"[DEBUG] Prompt usage for {turn.user_id}: {usage_logger.summary()}")
+    return result["output"]
+
+def finish_turn(turn: AgentTurn, agent_output: str) -> str:
+    """Safety post-processing of the agent output (follow-ups, emergency handling), saving the turn to memory
+    and the session to the store. Summarising old turns is left to a background compact_memory()."""
+    try:
+        response = _finish_turn(turn, agent_output)
+    finally:
+        try:
+            session_store.save(turn.user_id, turn.session)
+        finally:
+            turn.lock.release()
+    schedule_memory_compaction(turn.user_id)
+    return response
+
+def _finish_turn(turn: AgentTurn, agent_output: str) -> str:
+    message, user_id, name = turn.message, turn.user_id, turn.name
+    intents, memory, symptom_facts = turn.intents, turn.memory, turn.symptom_facts
+    response = agent_output
     
     # If symptom facts were gathered, prepend them so the user sees concrete data
     if symptom_facts:
@@ -698,26 +1191,11 @@ def agent_response(message: str, user_id: str = None) -> str:
     # Detect agent's conclusion about severity and trigger appropriate actions
     response_lower = response.lower()
     
-    # Check if agent concluded it's serious - EXPANDED detection for safety
-    serious_indicators = [
-        "critical", "urgent", "emergency", "Emergency",
-        "call doctor immediately", "dangerous", "alarming",
-        "seek medical attention", "emergency room",
-        "heart-related symptoms","require immediate medical attention"
-        "high blood pressure", "low oxygen", "symptoms can be serious"
-        "tachycardia", "hypertension", "call 911",
-        "see a doctor immediately", "abnormal readings", "require immediate attention"
-    ]
-    is_serious_concluded = any(indicator in response_lower for indicator in serious_indicators)
-    
-    # Check if agent concluded it's mild - ONLY if not serious
-    mild_indicators = [
-        "rest", "mild", "appears to be mild", "seems mild", "not serious", "minor", 
-        "within normal range", "stay hydrated", "take a break", "dizziness","stable condition",
-        "no immediate concern", "routine", "minor issue"
-    ]
-    # Only check for mild if it's NOT already flagged as serious
-    is_mild_concluded = not is_serious_concluded and any(indicator in response_lower for indicator in mild_indicators)
+    # Check the agent's conclusion in one scan - EXPANDED detection for safety
+    severity = severity_classifier.classify(response)
+    is_serious_concluded = severity.has("serious")
+    # Only count mild if it's NOT already flagged as serious
+    is_mild_concluded = not is_serious_concluded and severity.has("mild")
     
     # Ensure only one is true - prioritize serious over mild
     if is_serious_concluded:
@@ -746,6 +1224,8 @@ def agent_response(message: str, user_id: str = None) -> str:
         # Store the complete response with emergency question in memory
         memory.save_context({"input": message}, {"output": response})
         return response  # Return immediately to ensure the emergency question is stored
+
+    memory.save_context({"input": message}, {"output": agent_output})
     
     # Emergency confirmation logic - if user says yes to emergency
     # Check if previous message contained emergency question or if current message is a yes response
@@ -753,10 +1233,10 @@ def agent_response(message: str, user_id: str = None) -> str:
     previous_has_emergency_question = any("emergency contact" in str(msg.content).lower() or "911" in str(msg.content).lower() for msg in previous_messages if hasattr(msg, 'content'))
     
     # Check if this is a response to emergency question
-    is_emergency_response = previous_has_emergency_question and ("yes" in message.lower() or "no" in message.lower())
+    is_emergency_response = previous_has_emergency_question and (intents.has("says_yes") or intents.has("says_no"))
     
     if is_emergency_response:
-        if "yes" in message.lower():
+        if intents.has("says_yes"):
             print(f"🚨 [EMERGENCY ALERT] User {name} (ID: {user_id}) has requested emergency assistance!")
             print(f"📞 [EMERGENCY] Calling 911 for {name}...")
             print(f"📍 [EMERGENCY] Sharing location with emergency services: 123 Main Street, Apartment 4B, Minneapolis, MN 55455")
@@ -769,7 +1249,7 @@ def agent_response(message: str, user_id: str = None) -> str:
             emergency_response = f"\n\nI've called 911 and contacted your emergency contacts. Don't worry, {name}, I'm here with you. Help is on the way.\n\nWhile we wait for emergency services to arrive, try to stay calm and comfortable. Take slow, deep breaths. If you're able, sit or lie down in a comfortable position. I'll stay with you until help arrives."
             response = response.strip() + emergency_response
             return response  # Return immediately to avoid further processing
-        elif "no" in message.lower():
+        elif intents.has("says_no"):
             # Convert serious to mild and add follow-up
             print(f"[INFO] User declined emergency services for {name}, converting to mild with follow-up")
             followup_msg = f"I understand you don't want emergency services right now. I'll check back with you in 5 minutes to see how you're feeling. (Reminder: Follow up with {name} in 5 minutes)"
@@ -779,7 +1259,7 @@ def agent_response(message: str, user_id: str = None) -> str:
             return response  # Return immediately to avoid further processing
     
     # Original emergency logic for direct serious responses
-    if (is_serious_concluded and ("yes" in message.lower() or "call" in message.lower() or "contact" in message.lower() or "please" in message.lower())):
+    if is_serious_concluded and intents.has("emergency_request"):
         print(f"🚨 [EMERGENCY ALERT] User {name} (ID: {user_id}) has requested emergency assistance!")
         print(f"📞 [EMERGENCY] Calling 911 for {name}...")
         print(f"📍 [EMERGENCY] Sharing location with emergency services: 123 Main Street, Apartment 4B, Minneapolis, MN 55455")
@@ -1,9 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 load_dotenv()
-from agent import agent_response, get_pending_followups
+from agent import agent_response, agent_response_stream, get_pending_followups
+from followup_scheduler import followup_broker, FOLLOWUP_KEEPALIVE_SECONDS
+import json
 import os
+import threading
 import openai
 from werkzeug.utils import secure_filename
 import tempfile
@@ -12,10 +15,6 @@ app = Flask(__name__)
 CORS(app)
 
 
-user_memories = {}
-pending_followups = {}
-emergency_states = {}
-
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
@@ -29,6 +28,31 @@ def chat():
         traceback.print_exc()  # This will print the full error in your terminal
         return jsonify({"error": str(e)}), 500
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /chat, but streams the reply as Server-Sent Events (token events, then one final event)"""
+    data = request.get_json()
+    user_input = data.get("message")
+    user_id = data.get("user_id")
+
+    def generate():
+        try:
+            for item in agent_response_stream(user_input, user_id=user_id):
+                yield sse_event(item.pop("event"), item)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route('/check-followups', methods=['POST'])
 def check_followups():
     try:
@@ -41,6 +65,33 @@ def check_followups():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/followups/stream', methods=['GET'])
+def followups_stream():
+    """Push follow-ups to the client as Server-Sent Events as soon as they fire (/check-followups still works)"""
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+
+    def generate():
+        wake = threading.Event()
+        followup_broker.subscribe(user_id, wake.set)
+        try:
+            while True:
+                for followup in get_pending_followups(user_id):
+                    yield sse_event("followup", {"text": followup})
+                if wake.wait(FOLLOWUP_KEEPALIVE_SECONDS):
+                    wake.clear()
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            followup_broker.unsubscribe(user_id, wake.set)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
     """Transcribe audio using OpenAI Whisper API"""
@@ -1,6 +1,10 @@
 import os
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from heapq import merge
+from typing import List, Dict, Optional, Tuple
 import json
 from google_calendar_integration import google_integration
 
@@ -155,41 +159,131 @@ APPOINTMENT_SLOTS = [
 
 
 
+SlotKey = Tuple[str, int, str]  # (date, minutes since midnight, slot_id): sorts chronologically
+
+
+def make_slot_id(date: str, time: str, doctor: str) -> str:
+    """Stable ID from what identifies a slot, e.g. "2025-07-29-0945-dr-emily-rodriguez" """
+    clock = datetime.strptime(time, "%I:%M %p").strftime("%H%M")
+    return f"{date}-{clock}-{re.sub(r'[^a-z0-9]+', '-', doctor.lower()).strip('-')}"
+
+
+class SlotInventory:
+    """Appointment slots keyed by stable slot_id, with sorted indexes for lookups.
+
+    Every index (all slots, per specialty, per doctor, per date) is a list of SlotKeys kept
+    in chronological order, holding only slots that are still available. A query picks
+    one index and bisects it for the date range, so it costs O(log n + results); booking
+    takes the slot out of each index it belongs to.
+    """
+
+    def __init__(self, slots: List[Dict]):
+        self._slots: Dict[str, Dict] = {}
+        self._available: List[SlotKey] = []
+        self._by_specialty: Dict[str, List[SlotKey]] = {}
+        self._by_doctor: Dict[str, List[SlotKey]] = {}
+        self._by_date: Dict[str, List[SlotKey]] = {}
+        self._lock = threading.Lock()
+        for slot in slots:
+            self.add(slot)
+
+    def _key(self, slot: Dict) -> SlotKey:
+        clock = datetime.strptime(slot["time"], "%I:%M %p")
+        return (slot["date"], clock.hour * 60 + clock.minute, slot["slot_id"])
+
+    def _indexes(self, slot: Dict) -> List[List[SlotKey]]:
+        return [
+            self._available,
+            self._by_specialty.setdefault(slot["specialty"].lower(), []),
+            self._by_doctor.setdefault(slot["doctor"].lower(), []),
+            self._by_date.setdefault(slot["date"], []),
+        ]
+
+    def add(self, slot: Dict) -> str:
+        """Add a slot (the dict gains its slot_id) and return its ID"""
+        slot["slot_id"] = slot.get("slot_id") or make_slot_id(slot["date"], slot["time"], slot["doctor"])
+        with self._lock:
+            self._slots[slot["slot_id"]] = slot
+            if slot.get("available", True):
+                key = self._key(slot)
+                for index in self._indexes(slot):
+                    insort(index, key)
+        return slot["slot_id"]
+
+    def get(self, slot_id: str) -> Optional[Dict]:
+        return self._slots.get(slot_id)
+
+    def available(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                  specialty: Optional[str] = None, doctor: Optional[str] = None) -> List[Dict]:
+        """Available slots in date order, optionally limited to a date range (inclusive),
+        a specialty (substring match, as before) and/or a doctor"""
+        with self._lock:
+            if doctor:
+                indexes = [self._by_doctor.get(doctor.lower(), [])]
+            elif specialty:
+                wanted = specialty.lower()
+                indexes = [keys for name, keys in self._by_specialty.items() if wanted in name]
+            elif start_date and start_date == end_date:
+                indexes = [self._by_date.get(start_date, [])]
+            else:
+                indexes = [self._available]
+            keys = merge(*(self._date_range(index, start_date, end_date) for index in indexes))
+            slots = [self._slots[key[2]] for key in keys]
+        if doctor and specialty:
+            slots = [slot for slot in slots if specialty.lower() in slot["specialty"].lower()]
+        return slots
+
+    @staticmethod
+    def _date_range(index: List[SlotKey], start_date: Optional[str], end_date: Optional[str]) -> List[SlotKey]:
+        lo = bisect_left(index, (start_date,)) if start_date else 0
+        hi = bisect_right(index, (end_date, float("inf"))) if end_date else len(index)
+        return index[lo:hi]
+
+    def book(self, slot_id: str) -> Optional[Dict]:
+        """Mark a slot taken; returns it, or None if it doesn't exist or is already booked"""
+        with self._lock:
+            slot = self._slots.get(slot_id)
+            if slot is None or not slot.get("available", True):
+                return None
+            slot["available"] = False
+            key = self._key(slot)
+            for index in self._indexes(slot):
+                position = bisect_left(index, key)
+                if position < len(index) and index[position] == key:
+                    del index[position]
+            return slot
+
+
+slot_inventory = SlotInventory(APPOINTMENT_SLOTS)
+
+
 def get_current_date() -> str:
     """Get current date in YYYY-MM-DD format"""
     return datetime.now().strftime("%Y-%m-%d")
 
 def get_available_slots() -> List[Dict]:
     """Get all available appointment slots"""
-    current_date = get_current_date()
-    # Filter out past dates
-    available_slots = [
-        slot for slot in APPOINTMENT_SLOTS 
-        if slot["date"] >= current_date and slot["available"]
-    ]
-    return available_slots
+    # Past dates are left out
+    return slot_inventory.available(start_date=get_current_date())
 
 def get_slots_for_week(week_offset: int = 0) -> List[Dict]:
     """Get available slots for a specific week (0 = current week, 1 = next week, etc.)"""
     current_date = datetime.now()
     target_week_start = current_date + timedelta(weeks=week_offset)
     target_week_end = target_week_start + timedelta(days=6)
-    
-    available_slots = get_available_slots()
-    week_slots = [
-        slot for slot in available_slots
-        if target_week_start.date() <= datetime.strptime(slot["date"], "%Y-%m-%d").date() <= target_week_end.date()
-    ]
-    return week_slots
+    start_date = max(target_week_start.strftime("%Y-%m-%d"), get_current_date())
+    return slot_inventory.available(start_date=start_date, end_date=target_week_end.strftime("%Y-%m-%d"))
 
 def get_slots_by_specialty(specialty: str) -> List[Dict]:
     """Get available slots for a specific specialty"""
-    available_slots = get_available_slots()
-    specialty_slots = [
-        slot for slot in available_slots
-        if specialty.lower() in slot["specialty"].lower()
-    ]
-    return specialty_slots
+    return slot_inventory.available(start_date=get_current_date(), specialty=specialty)
+
+def display_order(slots: List[Dict]) -> List[Dict]:
+    """Slots in the order format_slots_for_display numbers them (grouped by specialty)"""
+    specialty_groups = {}
+    for slot in slots:
+        specialty_groups.setdefault(slot['specialty'], []).append(slot)
+    return [slot for specialty_slots in specialty_groups.values() for slot in specialty_slots]
 
 def get_specialty_recommendation(symptoms: str) -> str:
     """Recommend a specialty based on symptoms"""
@@ -211,13 +305,10 @@ def format_slots_for_display(slots: List[Dict]) -> str:
     if not slots:
         return "No available appointments found for the requested time period."
     
-    # Group slots by specialty
+    # Group slots by specialty (display_order gives the same numbering)
     specialty_groups = {}
-    for slot in slots:
-        specialty = slot['specialty']
-        if specialty not in specialty_groups:
-            specialty_groups[specialty] = []
-        specialty_groups[specialty].append(slot)
+    for slot in display_order(slots):
+        specialty_groups.setdefault(slot['specialty'], []).append(slot)
     
     formatted = "🏥 Available Appointment Slots:\n\n"
     slot_number = 1
@@ -243,7 +334,7 @@ def format_slots_for_display(slots: List[Dict]) -> str:
     return formatted
 
 def book_appointment(slot_index: int, patient_name: str, reason: str, user_id: str) -> Dict:
-    """Book an appointment and return booking details"""
+    """Book an appointment by its 1-based position in get_available_slots() and return booking details"""
     available_slots = get_available_slots()
     
     if slot_index < 1 or slot_index > len(available_slots):
@@ -252,18 +343,21 @@ def book_appointment(slot_index: int, patient_name: str, reason: str, user_id: s
             "message": f"Invalid slot number. Please choose between 1 and {len(available_slots)}"
         }
     
-    selected_slot = available_slots[slot_index - 1]
-    
+    return book_slot(available_slots[slot_index - 1]["slot_id"], patient_name, reason, user_id)
+
+def book_slot(slot_id: str, patient_name: str, reason: str, user_id: str) -> Dict:
+    """Book an appointment by slot_id and return booking details"""
     # Mark slot as unavailable
-    for slot in APPOINTMENT_SLOTS:
-        if (slot["date"] == selected_slot["date"] and 
-            slot["time"] == selected_slot["time"] and 
-            slot["doctor"] == selected_slot["doctor"]):
-            slot["available"] = False
-            break
+    selected_slot = slot_inventory.book(slot_id)
+    if selected_slot is None:
+        return {
+            "success": False,
+            "message": "Sorry, that slot is no longer available. Please choose another."
+        }
     
     # Create booking details
     booking = {
+        "slot_id": slot_id,
         "patient_name": patient_name,
         "user_id": user_id,
         "appointment_date": selected_slot["date"],
@@ -0,0 +1,151 @@
+"""Async (ASGI) server exposing the same routes as app.py.
+
+LLM calls and Whisper transcription are awaited instead of holding a thread each, so one
+process can serve many concurrent conversations. Run with:
+
+    hypercorn asgi_app:app --bind 0.0.0.0:5050
+"""
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
+from dotenv import load_dotenv
+load_dotenv()
+from agent import agent_response_async, agent_response_astream, get_pending_followups
+from followup_scheduler import followup_broker, FOLLOWUP_KEEPALIVE_SECONDS
+import asyncio
+import json
+import os
+import openai
+
+app = cors(Quart(__name__))
+
+_whisper_client = None
+
+
+def get_whisper_client() -> openai.AsyncOpenAI:
+    global _whisper_client
+    if _whisper_client is None:
+        _whisper_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _whisper_client
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    try:
+        data = await request.get_json()
+        user_input = data.get("message")
+        user_id = data.get("user_id")
+        response = await agent_response_async(user_input, user_id=user_id)
+        return jsonify({"response": response})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Same as /chat, but streams the reply as Server-Sent Events (token events, then one final event)"""
+    data = await request.get_json()
+    user_input = data.get("message")
+    user_id = data.get("user_id")
+
+    async def generate():
+        try:
+            async for item in agent_response_astream(user_input, user_id=user_id):
+                yield sse_event(item.pop("event"), item)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None  # replies can take longer than the default response timeout
+    return response
+
+
+@app.route('/check-followups', methods=['POST'])
+async def check_followups():
+    try:
+        data = await request.get_json()
+        user_id = data.get("user_id")
+        # pop_followups may wait on SQLite's write lock, so keep it off the event loop
+        followups = await asyncio.to_thread(get_pending_followups, user_id)
+        return jsonify({"followups": followups})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/followups/stream', methods=['GET'])
+async def followups_stream():
+    """Push follow-ups to the client as Server-Sent Events as soon as they fire (/check-followups still works)"""
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            # Called from the scheduler thread
+            loop.call_soon_threadsafe(event.set)
+
+        followup_broker.subscribe(user_id, wake)
+        try:
+            while True:
+                for followup in await asyncio.to_thread(get_pending_followups, user_id):
+                    yield sse_event("followup", {"text": followup})
+                try:
+                    await asyncio.wait_for(event.wait(), FOLLOWUP_KEEPALIVE_SECONDS)
+                    event.clear()
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            followup_broker.unsubscribe(user_id, wake)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None
+    return response
+
+
+@app.route('/transcribe', methods=['POST'])
+async def transcribe_audio():
+    """Transcribe audio using OpenAI Whisper API"""
+    try:
+        files = await request.files
+        if 'audio' not in files:
+            return jsonify({"error": "No audio file provided"}), 400
+
+        audio_file = files['audio']
+        if audio_file.filename == '':
+            return jsonify({"error": "No audio file selected"}), 400
+
+        try:
+            # Uploads are small, so send them from memory instead of a temp file
+            response = await get_whisper_client().audio.transcriptions.create(
+                model="whisper-1",
+                file=(audio_file.filename or "recording.webm", audio_file.read()),
+                language="en"
+            )
+            return jsonify({"transcription": response.text.strip()})
+        except Exception as e:
+            print(f"Whisper API error: {str(e)}")
+            return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
+
+    except Exception as e:
+        print(f"Transcribe endpoint error: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+if __name__ == '__main__':
+    app.run(port=5050)
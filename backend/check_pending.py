@@ -3,12 +3,13 @@
 # Import the agent module to check pending appointments
 import sys
 sys.path.append('.')
-from agent import pending_appointment, pending_slots
+from agent import session_store
 
-def check_pending_state():
-    print("=== CHECKING PENDING STATE ===")
-    print(f"pending_appointment: {pending_appointment}")
-    print(f"pending_slots: {pending_slots}")
+def check_pending_state(user_id="user_john"):
+    session = session_store.load(user_id)
+    print(f"=== CHECKING PENDING STATE ({user_id}) ===")
+    print(f"pending_appointment: {session.pending_appointment}")
+    print(f"pending_slots: {session.pending_slots}")
 
 if __name__ == "__main__":
-    check_pending_state() 
\ No newline at end of file
+    check_pending_state(*sys.argv[1:2])
@@ -0,0 +1,190 @@
+import datetime
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from dateparser.date import DateDataParser
+from dateparser.search import search_dates
+
+DATE_CACHE_SIZE = int(os.environ.get("DATE_CACHE_SIZE", "4096"))
+# Longest span extract_date_range returns; longer ones keep their most recent days
+DATE_RANGE_MAX_DAYS = int(os.environ.get("DATE_RANGE_MAX_DAYS", "366"))
+
+_MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sept": 9, "sep": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+_UNIT_DAYS = {"day": 1, "week": 7, "month": 30}
+
+# Whole words only, so "apricots", "decaf" or "marathons" aren't read as months
+_MONTH = r"\b(" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\b\.?"
+_WEEKDAY = "(" + "|".join(_WEEKDAYS) + ")"
+_COUNT = r"(\d+|" + "|".join(_NUMBER_WORDS) + ")"
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_SLASH_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{4}|\d{2}))?\b")
+_MONTH_DAY = re.compile(_MONTH + r"\s+(\d{1,2})(?:st|nd|rd|th)?\b(?:,?\s+(\d{4})\b)?", re.IGNORECASE)
+_DAY_MONTH = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?" + _MONTH + r"(?:,?\s+(\d{4})\b)?", re.IGNORECASE)
+_RELATIVE_DAY = re.compile(
+    r"\b(day before yesterday|yesterday|today|tonight|this morning|this afternoon|this evening|tomorrow)\b",
+    re.IGNORECASE
+)
+_UNITS_AGO = re.compile(r"\b" + _COUNT + r"\s+(day|week|month)s?\s+ago\b", re.IGNORECASE)
+_LAST_UNIT_DAY = re.compile(r"\blast\s+(week|month)\b", re.IGNORECASE)
+_WEEKDAY_NAME = re.compile(r"\b(?:(last|this|on)\s+)?" + _WEEKDAY + r"\b", re.IGNORECASE)
+_RELATIVE_OFFSETS = {
+    "day before yesterday": -2, "yesterday": -1, "today": 0, "tonight": 0, "this morning": 0,
+    "this afternoon": 0, "this evening": 0, "tomorrow": 1,
+}
+
+# Only text with a digit or one of these whole words is worth handing to dateparser
+# ("junk", "decaf" or "marching" are not)
+_DATE_HINT = re.compile(
+    r"\d|\b(?:yesterday|today|tomorrow|last|ago|weeks?|months?|years?|"
+    + "|".join(_MONTHS) + "|" + "|".join(_WEEKDAYS) + r")\b",
+    re.IGNORECASE
+)
+_SEARCH_HINTS = ("yesterday", "today", "tomorrow", "last", "ago", "week", "month", "year")
+
+_RANGE_LAST_N = re.compile(r"\b(?:last|past|previous)\s+(\d+)\s+(day|week|month)s?\b", re.IGNORECASE)
+_RANGE_LAST_UNIT = re.compile(r"\b(?:last|past|previous)\s+(week|month)\b", re.IGNORECASE)
+_RANGE_THIS_UNIT = re.compile(r"\bthis\s+(week|month)\b", re.IGNORECASE)
+_RANGE_SINCE = re.compile(r"\bsince\s+(.+)", re.IGNORECASE)
+_RANGE_BETWEEN = re.compile(r"\b(?:from|between)\s+(.+?)\s+(?:to|and|until|through)\s+(.+)", re.IGNORECASE)
+
+
+def _year(value: Optional[str], today: datetime.date) -> int:
+    if not value:
+        return today.year
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _fast_candidates(text: str, today: datetime.date) -> List[Tuple[int, datetime.date]]:
+    """(position, date) for every common date form the compiled patterns recognise"""
+    found = []
+
+    def add(match, build):
+        try:
+            found.append((match.start(), build(match)))
+        except (ValueError, OverflowError):
+            pass  # e.g. "February 30" or "13/45"
+
+    for m in _ISO_DATE.finditer(text):
+        add(m, lambda m: datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3))))
+    for m in _SLASH_DATE.finditer(text):
+        add(m, lambda m: datetime.date(_year(m.group(3), today), int(m.group(1)), int(m.group(2))))
+    for m in _MONTH_DAY.finditer(text):
+        add(m, lambda m: datetime.date(_year(m.group(3), today), _MONTHS[m.group(1).lower()], int(m.group(2))))
+    for m in _DAY_MONTH.finditer(text):
+        add(m, lambda m: datetime.date(_year(m.group(3), today), _MONTHS[m.group(2).lower()], int(m.group(1))))
+    for m in _RELATIVE_DAY.finditer(text):
+        add(m, lambda m: today + datetime.timedelta(days=_RELATIVE_OFFSETS[m.group(1).lower()]))
+    for m in _UNITS_AGO.finditer(text):
+        add(m, lambda m: today - datetime.timedelta(
+            days=int(_NUMBER_WORDS.get(m.group(1).lower(), m.group(1))) * _UNIT_DAYS[m.group(2).lower()]
+        ))
+    for m in _LAST_UNIT_DAY.finditer(text):
+        add(m, lambda m: today - datetime.timedelta(days=_UNIT_DAYS[m.group(1).lower()]))
+    for m in _WEEKDAY_NAME.finditer(text):
+        def weekday_date(m):
+            back = (today.weekday() - _WEEKDAYS.index(m.group(2).lower())) % 7
+            if back == 0 and (m.group(1) or "").lower() == "last":
+                back = 7
+            return today - datetime.timedelta(days=back)
+        add(m, weekday_date)
+    return found
+
+
+@lru_cache(maxsize=2)
+def _parser(today: datetime.date) -> DateDataParser:
+    """English-only parser built once per reference day (settings are fixed at construction)"""
+    base = datetime.datetime.combine(today, datetime.time(12))
+    return DateDataParser(languages=["en"], settings={"RELATIVE_BASE": base})
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_fallback(text: str, today: datetime.date) -> Optional[str]:
+    """dateparser for whatever the fast path missed, English only and memoised per (text, day)"""
+    base = datetime.datetime.combine(today, datetime.time(12))
+    settings = {"RELATIVE_BASE": base}
+    results = search_dates(text, languages=["en"], settings=settings)
+    if results:
+        for txt, dt in results:
+            txt_l = txt.lower().strip()
+            # Accept if the match contains any digit OR clearly date-related keywords
+            if any(ch.isdigit() for ch in txt) or any(k in txt_l for k in _SEARCH_HINTS):
+                return dt.strftime('%Y-%m-%d')
+    dt = _parser(today).get_date_data(text).date_obj
+    return dt.strftime('%Y-%m-%d') if dt else None
+
+
+def _fast_date(text: str, today: datetime.date) -> Optional[datetime.date]:
+    """The first date the compiled patterns find in `text`, without the dateparser fallback"""
+    candidates = _fast_candidates(text, today)
+    return min(candidates, key=lambda c: c[0])[1] if candidates else None
+
+
+def extract_date(text: str, today: Optional[datetime.date] = None) -> Optional[str]:
+    """Return a YYYY-MM-DD string for the first date expression in `text`, or None.
+
+    Common forms ("today", "yesterday", "3 days ago", ISO and slash dates, "July 14",
+    weekday names) are matched by compiled patterns. Anything else that looks date-like
+    falls back to an English-only dateparser, cached per (text, reference day).
+    """
+    today = today or datetime.date.today()
+    found = _fast_date(text, today)
+    if found:
+        return found.strftime('%Y-%m-%d')
+    if not _DATE_HINT.search(text):
+        return None
+    return _parse_fallback(" ".join(text.split()), today)
+
+
+def extract_date_range(text: str, today: Optional[datetime.date] = None) -> Optional[Tuple[str, str]]:
+    """Return (start, end) YYYY-MM-DD strings, inclusive, if the text asks about a span of days.
+
+    Handles "last/past N days|weeks|months", "last week", "this week" (since Monday),
+    "this month", "since <day>" and "from/between <day> to/and <day>". Single-day
+    questions return None; use extract_date for those.
+
+    The days after "since", "from" and "between" must be forms the compiled patterns
+    recognise, so numbers such as "from 5 to 8" (pain levels, hours) aren't read as
+    months by dateparser. Ranges end today at the latest and cover at most
+    DATE_RANGE_MAX_DAYS days.
+    """
+    today = today or datetime.date.today()
+    end = today
+    match = _RANGE_LAST_N.search(text)
+    if match:
+        days = int(match.group(1)) * _UNIT_DAYS[match.group(2).lower()]
+        start = today - datetime.timedelta(days=max(days - 1, 0))
+    elif _RANGE_LAST_UNIT.search(text):
+        start = today - datetime.timedelta(days=_UNIT_DAYS[_RANGE_LAST_UNIT.search(text).group(1).lower()] - 1)
+    elif _RANGE_THIS_UNIT.search(text):
+        unit = _RANGE_THIS_UNIT.search(text).group(1).lower()
+        start = today - datetime.timedelta(days=today.weekday()) if unit == "week" else today.replace(day=1)
+    elif _RANGE_BETWEEN.search(text):
+        match = _RANGE_BETWEEN.search(text)
+        first, second = _fast_date(match.group(1), today), _fast_date(match.group(2), today)
+        if not (first and second):
+            return None
+        start, end = min(first, second), min(max(first, second), today)
+    elif _RANGE_SINCE.search(text):
+        start = _fast_date(_RANGE_SINCE.search(text).group(1), today)
+        if not start:
+            return None
+    else:
+        return None
+    if start > end:
+        return None
+    start = max(start, end - datetime.timedelta(days=DATE_RANGE_MAX_DAYS - 1))
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+# Optional SQLite file so cached embeddings survive restarts; unset keeps the cache in memory only
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")
+
+
+def normalize_text(text: str) -> str:
+    """Cache key form of a text: case-folded with whitespace collapsed"""
+    return " ".join(text.split()).casefold()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an LRU cache.
+
+    Keys are (model, normalized text). Misses go to the wrapped client in one batch and
+    are written through to the optional on-disk store.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, max_entries: int = EMBEDDING_CACHE_SIZE, path: Optional[str] = EMBEDDING_CACHE_PATH):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, text TEXT, vector BLOB, PRIMARY KEY (model, text))"
+            )
+            self._db.commit()
+
+    def _get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text = ?", key
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def _remember(self, key: Tuple[str, str], vector: List[float]):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _put_many(self, items: List[Tuple[Tuple[str, str], List[float]]]):
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text, vector) VALUES (?, ?, ?)",
+                    [(key[0], key[1], np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+                )
+                self._db.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [(self.model, normalize_text(text)) for text in texts]
+        results = [self._get(key) for key in keys]
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            # Embed each distinct missing text once
+            unique: Dict[Tuple[str, str], int] = {}
+            for i in missing:
+                unique.setdefault(keys[i], i)
+            vectors = self.embeddings.embed_documents([texts[i] for i in unique.values()])
+            fresh = dict(zip(unique.keys(), vectors))
+            self._put_many(list(fresh.items()))
+            for i in missing:
+                results[i] = fresh[keys[i]]
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (self.model, normalize_text(text))
+        vector = self._get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put_many([(key, vector)])
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self):
+        """Drop the in-memory entries (the on-disk store is kept)"""
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,191 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+FOLLOWUP_DELAY_SECONDS = float(os.environ.get("FOLLOWUP_DELAY_SECONDS", "300"))
+# How often an idle follow-up stream sends a comment line, so dead connections get noticed
+FOLLOWUP_KEEPALIVE_SECONDS = float(os.environ.get("FOLLOWUP_KEEPALIVE_SECONDS", "15"))
+
+JobKey = Tuple[str, str]
+
+
+class FollowupJob:
+    """One scheduled callback, identified by (user_id, key)"""
+
+    __slots__ = ("user_id", "key", "due", "callback", "cancelled")
+
+    def __init__(self, user_id: str, key: str, due: float, callback: Callable[[], None]):
+        self.user_id = user_id
+        self.key = key
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+
+class FollowupScheduler:
+    """All follow-ups on one daemon thread, ordered by a heap of due times.
+
+    At most one job is pending per (user_id, key): scheduling a key that is already
+    pending coalesces into the existing job instead of adding a second one. Cancelled
+    and rescheduled jobs stay in the heap as dead entries and are skipped when popped;
+    the heap is rebuilt once dead entries outnumber live ones.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, FollowupJob]] = []
+        self._jobs: Dict[JobKey, FollowupJob] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.scheduled = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.fired = 0
+
+    def schedule(self, user_id: str, key: str, callback: Callable[[], None],
+                 delay: float = FOLLOWUP_DELAY_SECONDS) -> bool:
+        """Run callback after `delay` seconds. Returns False if the job was already pending (coalesced)"""
+        with self._cond:
+            if (user_id, key) in self._jobs:
+                self.coalesced += 1
+                return False
+            self._push(FollowupJob(user_id, key, time.monotonic() + delay, callback))
+            self.scheduled += 1
+            self._ensure_thread()
+            return True
+
+    def reschedule(self, user_id: str, key: str, delay: float = FOLLOWUP_DELAY_SECONDS) -> bool:
+        """Move a pending job to `delay` seconds from now. Returns False if nothing was pending"""
+        with self._cond:
+            job = self._jobs.get((user_id, key))
+            if job is None:
+                return False
+            job.cancelled = True
+            self._push(FollowupJob(user_id, key, time.monotonic() + delay, job.callback))
+            return True
+
+    def cancel(self, user_id: str, key: Optional[str] = None) -> int:
+        """Cancel one pending job, or every pending job for the user when key is None"""
+        with self._cond:
+            keys = [(user_id, key)] if key is not None else [k for k in self._jobs if k[0] == user_id]
+            count = 0
+            for job_key in keys:
+                job = self._jobs.pop(job_key, None)
+                if job is not None:
+                    job.cancelled = True
+                    count += 1
+            self.cancelled += count
+            self._compact()
+            return count
+
+    def pending(self, user_id: Optional[str] = None) -> List[Dict]:
+        """Pending jobs (optionally for one user), soonest first"""
+        now = time.monotonic()
+        with self._cond:
+            jobs = [job for job in self._jobs.values() if user_id is None or job.user_id == user_id]
+        return [
+            {"user_id": job.user_id, "key": job.key, "due_in": max(job.due - now, 0.0)}
+            for job in sorted(jobs, key=lambda job: job.due)
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "pending": len(self._jobs),
+                "heap_size": len(self._heap),
+                "scheduled": self.scheduled,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "fired": self.fired,
+            }
+
+    def _push(self, job: FollowupJob):
+        self._jobs[(job.user_id, job.key)] = job
+        heapq.heappush(self._heap, (job.due, next(self._seq), job))
+        self._compact()
+        self._cond.notify()
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._jobs) + 16:
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="followup-scheduler", daemon=True)
+            self._thread.start()
+
+    def _next_due_job(self) -> FollowupJob:
+        """Block until the earliest live job is due, then remove and return it"""
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, job = self._heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                del self._jobs[(job.user_id, job.key)]
+                self.fired += 1
+                return job
+
+    def _run(self):
+        while True:
+            job = self._next_due_job()
+            try:
+                job.callback()
+            except Exception as e:
+                print(f"[WARNING] Follow-up {job.key} for {job.user_id} failed: {e}")
+
+
+class FollowupBroker:
+    """Wakes connected follow-up streams when a user has new follow-ups.
+
+    Messages themselves stay in the pending queue; a woken stream drains it. A message
+    that fires while the user has no open stream is still there for the next
+    connection or for /check-followups polling.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[], None]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: str, wake: Callable[[], None]):
+        """Register a thread-safe wake callback for one open stream"""
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(wake)
+
+    def unsubscribe(self, user_id: str, wake: Callable[[], None]):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, [])
+            if wake in subscribers:
+                subscribers.remove(wake)
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def notify(self, user_id: str) -> int:
+        """Wake every stream open for the user; returns how many there were"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, []))
+        for wake in subscribers:
+            try:
+                wake()
+            except Exception as e:
+                print(f"[WARNING] Could not wake follow-up stream for {user_id}: {e}")
+        return len(subscribers)
+
+    def connected(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+followup_scheduler = FollowupScheduler()
+followup_broker = FollowupBroker()
@@ -0,0 +1,209 @@
+import datetime
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+HEALTH_CACHE_MAX_ENTRIES = int(os.environ.get("HEALTH_CACHE_MAX_ENTRIES", "20000"))
+# Past days never change unless re-ingested, so they can live long; today's data is still arriving
+HEALTH_CACHE_PAST_TTL = float(os.environ.get("HEALTH_CACHE_PAST_TTL", "86400"))
+HEALTH_CACHE_TODAY_TTL = float(os.environ.get("HEALTH_CACHE_TODAY_TTL", "60"))
+# Append-only log of (user, date, type) keys written by ingestion, shared across processes.
+# Each ingestion run rewrites it first, keeping only events young enough to still matter
+# to a cached entry (see compact_ingest_events).
+INGEST_EVENTS_PATH = os.environ.get("INGEST_EVENTS_PATH", "ingest_events.log")
+INGEST_EVENTS_RETENTION = max(HEALTH_CACHE_PAST_TTL, HEALTH_CACHE_TODAY_TTL)
+INGEST_EVENTS_POLL_INTERVAL = 1.0
+
+CacheKey = Tuple[str, str, str]
+
+
+class HealthContextCache:
+    """LRU + TTL cache of retrieved health records keyed by (user_id, date, data_type).
+
+    Entries for past dates get a long TTL and entries for today (or later) a short one.
+    Ingestion invalidates keys directly when it runs in this process. When it runs
+    elsewhere, the cache tails the ingest events log, checking it at most once per
+    INGEST_EVENTS_POLL_INTERVAL. A log replaced by compaction is replayed from the start.
+    """
+
+    def __init__(self, max_entries: int = HEALTH_CACHE_MAX_ENTRIES, past_ttl: float = HEALTH_CACHE_PAST_TTL,
+                 today_ttl: float = HEALTH_CACHE_TODAY_TTL, events_path: Optional[str] = INGEST_EVENTS_PATH):
+        self.max_entries = max_entries
+        self.past_ttl = past_ttl
+        self.today_ttl = today_ttl
+        self.events_path = events_path
+        self._entries: "OrderedDict[CacheKey, Tuple[float, list]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._events_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._events_inode, self._events_offset = self._events_stat()
+        self._events_checked_at = time.monotonic()
+
+    def _ttl_for(self, date_str: str) -> float:
+        return self.past_ttl if date_str < datetime.date.today().strftime('%Y-%m-%d') else self.today_ttl
+
+    def get(self, user_id: str, date_str: str, data_type: str) -> Optional[list]:
+        """Cached records for the key, or None on a miss (an empty list means "known to have no data")"""
+        self._poll_ingest_events()
+        key = (user_id, date_str, data_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, user_id: str, date_str: str, data_type: str, value: list):
+        key = (user_id, date_str, data_type)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl_for(date_str), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str, date_str: Optional[str] = None, data_type: Optional[str] = None):
+        """Drop a key; leaving date_str or data_type as None drops every matching entry for the user"""
+        with self._lock:
+            if date_str is not None and data_type is not None:
+                removed = 1 if self._entries.pop((user_id, date_str, data_type), None) is not None else 0
+            else:
+                stale = [
+                    key for key in self._entries
+                    if key[0] == user_id
+                    and (date_str is None or key[1] == date_str)
+                    and (data_type is None or key[2] == data_type)
+                ]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+            self.invalidations += removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _events_stat(self) -> Tuple[int, int]:
+        """(inode, size) of the ingest events log, (0, 0) if there is none"""
+        try:
+            stat = os.stat(self.events_path) if self.events_path else None
+        except OSError:
+            stat = None
+        return (stat.st_ino, stat.st_size) if stat else (0, 0)
+
+    def _poll_ingest_events(self):
+        """Apply invalidations that other processes appended to the ingest events log"""
+        if not self.events_path:
+            return
+        if time.monotonic() - self._events_checked_at < INGEST_EVENTS_POLL_INTERVAL:
+            return
+        if not self._events_lock.acquire(blocking=False):
+            return
+        try:
+            self._events_checked_at = time.monotonic()
+            inode, size = self._events_stat()
+            if inode != self._events_inode:
+                # Replaced by compaction: the new log holds every event that can still
+                # matter to a cached entry, so replaying it all invalidates what it must
+                self._events_inode, self._events_offset = inode, 0
+            if size == self._events_offset:
+                return
+            if size < self._events_offset:
+                # Log was rotated or truncated; we can't tell what changed, so start over
+                self.clear()
+                self._events_offset = size
+                return
+            try:
+                with open(self.events_path, "rb") as f:
+                    f.seek(self._events_offset)
+                    chunk = f.read(size - self._events_offset)
+            except OSError:
+                return
+            # Only consume complete lines; a partially written one is picked up next time
+            consumed = chunk.rfind(b"\n") + 1
+            self._events_offset += consumed
+            for line in chunk[:consumed].decode("utf-8", errors="replace").splitlines():
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self.invalidate(event.get("user_id"), event.get("date"), event.get("data_type"))
+        finally:
+            self._events_lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "approx_bytes": sum(
+                    len(getattr(doc, "page_content", "")) for _, value in self._entries.values() for doc in value
+                ),
+            }
+
+
+health_cache = HealthContextCache()
+
+
+def record_ingest_events(keys: List[CacheKey]):
+    """Called by ingestion after writing records: invalidate in-process and log for other processes"""
+    if not keys:
+        return
+    for user_id, date_str, data_type in keys:
+        health_cache.invalidate(user_id, date_str, data_type)
+    if INGEST_EVENTS_PATH:
+        now = time.time()
+        with open(INGEST_EVENTS_PATH, "a") as f:
+            for user_id, date_str, data_type in keys:
+                f.write(json.dumps({"user_id": user_id, "date": date_str, "data_type": data_type, "at": now}) + "\n")
+
+
+def compact_ingest_events(path: Optional[str] = INGEST_EVENTS_PATH, retention: float = INGEST_EVENTS_RETENTION) -> int:
+    """Rewrite the ingest events log without events older than `retention` seconds.
+
+    Every cache entry lives at most that long, so an older event can't invalidate anything.
+    The log is replaced rather than truncated, which readers pick up as a new file. Call
+    it from the ingestion process before it appends. Returns the number of events dropped.
+    """
+    if not path:
+        return 0
+    try:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - retention
+    kept = []
+    for line in lines:
+        try:
+            at = json.loads(line).get("at", 0)
+        except ValueError:
+            continue
+        if line.endswith("\n") and at >= cutoff:
+            kept.append(line)
+    if len(kept) == len(lines):
+        return 0
+    with open(path + ".tmp", "w") as f:
+        f.writelines(kept)
+    os.replace(path + ".tmp", path)
+    return len(lines) - len(kept)
@@ -0,0 +1,265 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+import pinecone
+from langchain_core.documents import Document
+from langchain_openai import OpenAIEmbeddings
+from langchain_pinecone import PineconeVectorStore
+
+from embedding_cache import CachedEmbeddings
+from health_cache import HealthContextCache, health_cache
+from local_vector_store import LocalVectorStore
+from vitals_store import day_ordinal
+
+PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
+PINECONE_ENV = os.environ.get("PINECONE_ENVIRONMENT")
+INDEX_NAME = "elderly-health-agent"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# "pinecone" (hosted index) or "local" (NumPy store on disk at LOCAL_VECTOR_STORE_PATH)
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "pinecone").lower()
+LOCAL_VECTOR_STORE_PATH = os.environ.get("LOCAL_VECTOR_STORE_PATH", "vector_store")
+# How ingestion splits records into chunks; record_text() undoes the overlap
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+# Chunks per (user, type, day) record fetched in the ID fast path's first request; the
+# chunk_count metadata written by ingestion tells it which IDs of longer records are left
+MAX_CHUNKS_PER_RECORD = int(os.environ.get("MAX_CHUNKS_PER_RECORD", "4"))
+# Pinecone's top_k ceiling for queries that return metadata
+MAX_RANGE_RESULTS = 1000
+
+pc = None
+index = None
+_index_lock = threading.Lock()
+
+
+def get_pinecone_index():
+    """Return the shared Pinecone index handle, connecting on first use"""
+    global pc, index
+    if pc is not None or not (PINECONE_API_KEY and PINECONE_ENV):
+        return index
+    with _index_lock:
+        if pc is None:
+            try:
+                pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
+                index = pc.Index(INDEX_NAME)
+            except Exception as e:
+                print(f"Warning: Could not initialize Pinecone: {e}")
+                pc = None
+                index = None
+    return index
+
+
+def record_vector_id(user_id: str, data_type: str, day: str, chunk_index: int) -> str:
+    """Deterministic vector ID for one chunk of a (user, type, day) record, as written by ingestion"""
+    return f"{user_id}_{data_type}_{day}_{chunk_index}"
+
+
+def record_text(docs: List[Document]) -> str:
+    """Rebuild a record's text from its chunks in ingestion order (as fetch_day returns them).
+
+    Consecutive chunks share up to CHUNK_OVERLAP characters, starting at a word boundary;
+    that repeated part is dropped. Chunks with no overlap are joined with a space.
+    """
+    text = ""
+    for doc in docs:
+        chunk = doc.page_content
+        if not text:
+            text = chunk
+            continue
+        for size in range(min(CHUNK_OVERLAP, len(text), len(chunk)), 0, -1):
+            if text.endswith(chunk[:size]) and (size == len(text) or text[-size - 1].isspace()):
+                text += chunk[size:]
+                break
+        else:
+            text += " " + chunk
+    return text
+
+
+class HealthRetriever:
+    """Process-wide owner of the embeddings client, index handle and vector store used for RAG lookups.
+
+    Everything is created lazily on first use and then reused, so repeated lookups share
+    one HTTP connection pool instead of paying client setup and TLS handshakes every time.
+    The store is Pinecone by default, or a LocalVectorStore when VECTOR_STORE_BACKEND=local.
+    """
+
+    def __init__(self, index_factory=get_pinecone_index, embedding_model: str = EMBEDDING_MODEL,
+                 backend: str = VECTOR_STORE_BACKEND, local_path: str = LOCAL_VECTOR_STORE_PATH,
+                 cache: Optional[HealthContextCache] = health_cache):
+        self._index_factory = index_factory
+        self.cache = cache
+        self.embedding_model = embedding_model
+        self.backend = backend
+        self.local_path = local_path
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._vectorstore = None
+
+    def get_embeddings(self) -> CachedEmbeddings:
+        """Get the shared embeddings client, fronted by the query-embedding cache"""
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = CachedEmbeddings(
+                        OpenAIEmbeddings(model=self.embedding_model), self.embedding_model
+                    )
+        return self._embeddings
+
+    def get_vectorstore(self):
+        """Get the shared vector store, or None if the index is not reachable"""
+        if self._vectorstore is not None:
+            return self._vectorstore
+        if self.backend == "local":
+            embeddings = self.get_embeddings()
+            with self._lock:
+                if self._vectorstore is None:
+                    self._vectorstore = LocalVectorStore(self.local_path, embeddings)
+            return self._vectorstore
+
+        pinecone_index = self._index_factory()
+        if pinecone_index is None:
+            return None
+        embeddings = self.get_embeddings()
+        with self._lock:
+            if self._vectorstore is None:
+                self._vectorstore = PineconeVectorStore(
+                    index=pinecone_index,
+                    embedding=embeddings,
+                    text_key="text",
+                    index_name=INDEX_NAME
+                )
+        return self._vectorstore
+
+    def is_available(self) -> bool:
+        return self.get_vectorstore() is not None
+
+    def search(self, query: str, metadata_filter: Dict, k: int = 5) -> List[Document]:
+        """Run a filtered similarity search against the shared vector store"""
+        vectorstore = self.get_vectorstore()
+        if vectorstore is None:
+            return []
+        return vectorstore.similarity_search(query, k=k, filter=metadata_filter)
+
+    def search_day(self, query: str, user_id: str, date_str: str, data_types: List[str], k_per_type: int = 5) -> Dict[str, List[Document]]:
+        """Fetch several data types for one (user, date) with a single filtered search.
+
+        Results are grouped by data_type, each group keeping the vector store's ranking.
+        """
+        metadata_filter = {
+            "user_id": {"$eq": user_id},
+            "date": {"$eq": date_str},
+            "data_type": {"$in": list(data_types)}
+        }
+        docs = self.search(query, metadata_filter, k=k_per_type * len(data_types))
+        grouped = {data_type: [] for data_type in data_types}
+        for doc in docs:
+            grouped.setdefault(doc.metadata.get("data_type"), []).append(doc)
+        return grouped
+
+    def search_range(self, query: str, user_id: str, start_date: str, end_date: str,
+                     data_types: Optional[List[str]] = None, k_per_day: int = 3) -> Dict[str, List[Document]]:
+        """Fetch a user's records for start_date..end_date (inclusive) with one filtered search.
+
+        Filters on the numeric `date_ordinal` metadata written by ingestion. Results are
+        grouped by date in ascending order, each group keeping the vector store's ranking.
+        """
+        start_ordinal, end_ordinal = day_ordinal(start_date), day_ordinal(end_date)
+        metadata_filter = {
+            "user_id": {"$eq": user_id},
+            "date_ordinal": {"$gte": start_ordinal, "$lte": end_ordinal}
+        }
+        if data_types:
+            metadata_filter["data_type"] = {"$in": list(data_types)}
+        k = min(MAX_RANGE_RESULTS, k_per_day * (end_ordinal - start_ordinal + 1))
+        grouped: Dict[str, List[Document]] = {}
+        for doc in self.search(query, metadata_filter, k=k):
+            grouped.setdefault(doc.metadata.get("date"), []).append(doc)
+        return dict(sorted(grouped.items()))
+
+    def fetch_day(self, user_id: str, date_str: str, data_types: List[str]) -> Dict[str, List[Document]]:
+        """Fetch the stored chunks for exact (user, date, type) keys by vector ID.
+
+        No embedding call or similarity search is made: the IDs written by ingestion are
+        rebuilt and fetched directly, the first MAX_CHUNKS_PER_RECORD per record in one
+        request and the rest of longer records (per their chunk_count) in a second one.
+        Chunks come back in ingestion order. Records ingested without chunk_count that fill
+        the first request fall back to a filtered search. Keys already in the
+        health-context cache are served from it.
+        """
+        grouped = {}
+        missing = []
+        for data_type in data_types:
+            cached = self.cache.get(user_id, date_str, data_type) if self.cache else None
+            if cached is None:
+                missing.append(data_type)
+            else:
+                grouped[data_type] = cached
+        if not missing:
+            return grouped
+
+        fetched = {data_type: [] for data_type in missing}
+        ids = [
+            record_vector_id(user_id, data_type, date_str, i)
+            for data_type in missing
+            for i in range(MAX_CHUNKS_PER_RECORD)
+        ]
+        for doc in self.get_documents(ids):
+            fetched.setdefault(doc.metadata.get("data_type"), []).append(doc)
+
+        tail_ids = []
+        for data_type in missing:
+            docs = fetched[data_type]
+            if not docs:
+                continue
+            chunk_count = docs[0].metadata.get("chunk_count")
+            if chunk_count is not None:
+                tail_ids.extend(
+                    record_vector_id(user_id, data_type, date_str, i)
+                    for i in range(MAX_CHUNKS_PER_RECORD, int(chunk_count))
+                )
+            elif len(docs) >= MAX_CHUNKS_PER_RECORD:
+                metadata_filter = {
+                    "user_id": {"$eq": user_id},
+                    "date": {"$eq": date_str},
+                    "data_type": {"$eq": data_type}
+                }
+                fetched[data_type] = self.search(data_type, metadata_filter, k=MAX_RANGE_RESULTS)
+        if tail_ids:
+            for doc in self.get_documents(tail_ids):
+                fetched.setdefault(doc.metadata.get("data_type"), []).append(doc)
+        if self.cache:
+            for data_type in missing:
+                self.cache.put(user_id, date_str, data_type, fetched[data_type])
+        grouped.update(fetched)
+        return grouped
+
+    def get_documents(self, ids: List[str]) -> List[Document]:
+        """Fetch stored chunks by vector ID, in the order of `ids`; missing IDs are skipped"""
+        if self.backend == "local":
+            vectorstore = self.get_vectorstore()
+            found = vectorstore.get_documents(ids)
+            return [found[i] for i in ids if i in found]
+
+        pinecone_index = self._index_factory()
+        if pinecone_index is None:
+            return []
+        vectors = pinecone_index.fetch(ids=ids).vectors
+        docs = []
+        for vector_id in ids:
+            vector = vectors.get(vector_id)
+            if vector is None:
+                continue
+            metadata = dict(vector.metadata or {})
+            text = metadata.pop("text", "")
+            docs.append(Document(page_content=text, metadata=metadata))
+        return docs
+
+    def reset(self):
+        """Drop the cached clients so the next lookup reconnects"""
+        with self._lock:
+            self._embeddings = None
+            self._vectorstore = None
+
+
+health_retriever = HealthRetriever()
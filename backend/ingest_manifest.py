@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+INGEST_MANIFEST_PATH = os.environ.get("INGEST_MANIFEST_PATH", "ingest_manifest.json")
+
+# (vector_id, text, metadata), as produced by ingest_rag_data.iter_chunks
+Chunk = Tuple[str, str, dict]
+RecordKey = Tuple[str, str, str]
+
+
+def _record_key(metadata: dict) -> RecordKey:
+    return metadata["user_id"], metadata["date"], metadata["data_type"]
+
+
+class IngestPlan:
+    """What one run found while diffing its input against the manifest.
+
+    Stale IDs are worked out per record as its chunks go by, so only IDs to delete are
+    kept. Every seen ID is kept only with prune, which needs the full set at the end.
+    """
+
+    def __init__(self, prune: bool = False):
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.prune = prune
+        self.stale: Set[str] = set()
+        self.seen_ids: Set[str] = set()
+
+    def summary(self, stale_ids: List[str]) -> str:
+        return f"{self.new} new, {self.changed} changed, {self.unchanged} unchanged, {len(stale_ids)} to delete"
+
+
+class IngestManifest:
+    """Local record of the content hash of every vector ID already written to the store.
+
+    The hash covers the chunk text, its metadata and the embedding model, so a run only
+    needs to embed chunks whose hash differs, and switching models re-embeds everything.
+    Stored as {vector_id: [hash, user_id, date, data_type]} and held in memory while a
+    run is in progress, so it costs memory in proportion to the number of stored vectors
+    (not to the size of the input).
+    """
+
+    def __init__(self, path: str = INGEST_MANIFEST_PATH, model: str = ""):
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        self._entries: Dict[str, list] = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+        self._ids_by_key: Dict[RecordKey, Set[str]] = {}
+        for vector_id, (_, user_id, date_str, data_type) in self._entries.items():
+            self._ids_by_key.setdefault((user_id, date_str, data_type), set()).add(vector_id)
+
+    def chunk_hash(self, text: str, metadata: dict) -> str:
+        payload = json.dumps([self.model, text, metadata], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def diff(self, chunks: Iterable[Chunk], plan: IngestPlan, force: bool = False) -> Iterator[Chunk]:
+        """Yield only the chunks that are new or changed (all of them with force), tallying everything in `plan`.
+
+        A record's chunks arrive together, so once the next record starts, the IDs the
+        manifest has for the previous one that it no longer produced go into plan.stale.
+        """
+        key, record_ids = None, set()
+        for chunk in chunks:
+            vector_id, text, metadata = chunk
+            if _record_key(metadata) != key:
+                self._collect_stale(key, record_ids, plan)
+                key, record_ids = _record_key(metadata), set()
+            record_ids.add(vector_id)
+            if plan.prune:
+                plan.seen_ids.add(vector_id)
+            with self._lock:
+                entry = self._entries.get(vector_id)
+            if entry is None:
+                plan.new += 1
+            elif force or entry[0] != self.chunk_hash(text, metadata):
+                plan.changed += 1
+            else:
+                plan.unchanged += 1
+                continue
+            yield chunk
+        self._collect_stale(key, record_ids, plan)
+
+    def _collect_stale(self, key: RecordKey, record_ids: Set[str], plan: IngestPlan):
+        if key is None:
+            return
+        with self._lock:
+            plan.stale.update(self._ids_by_key.get(key, set()) - record_ids)
+
+    def stale_ids(self, plan: IngestPlan) -> List[str]:
+        """IDs to delete after a run.
+
+        By default only chunks of records that appeared in this run but no longer produce
+        that chunk (e.g. a record that got shorter). With a prune plan, every manifest ID
+        the run didn't see, for full refreshes where the input is the complete history.
+        """
+        with self._lock:
+            if plan.prune:
+                return sorted(set(self._entries) - plan.seen_ids)
+            return sorted(plan.stale)
+
+    def record_keys(self, ids: Iterable[str]) -> List[RecordKey]:
+        with self._lock:
+            return sorted({tuple(self._entries[i][1:]) for i in ids if i in self._entries})
+
+    def has_record(self, key: RecordKey) -> bool:
+        """Whether any chunk of the record is still in the store"""
+        with self._lock:
+            return bool(self._ids_by_key.get(key))
+
+    def mark_written(self, chunks: Iterable[Chunk]):
+        with self._lock:
+            for vector_id, text, metadata in chunks:
+                key = _record_key(metadata)
+                self._entries[vector_id] = [self.chunk_hash(text, metadata), *key]
+                self._ids_by_key.setdefault(key, set()).add(vector_id)
+
+    def mark_deleted(self, ids: Iterable[str]):
+        with self._lock:
+            for vector_id in ids:
+                entry = self._entries.pop(vector_id, None)
+                if entry is not None:
+                    self._ids_by_key.get(tuple(entry[1:]), set()).discard(vector_id)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self._entries, f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
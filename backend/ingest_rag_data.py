@@ -1,44 +1,313 @@
 # ingest_rag_data.py
 
+import argparse
+import csv
+import datetime
+import json
 import os
+import sys
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, Iterator, List, Tuple
+
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # Load environment variables from .env file
 load_dotenv()
 
+from health_retriever import record_vector_id, CHUNK_SIZE, CHUNK_OVERLAP, INDEX_NAME, VECTOR_STORE_BACKEND, LOCAL_VECTOR_STORE_PATH, EMBEDDING_MODEL
+from local_vector_store import LocalVectorStore
+from health_cache import compact_ingest_events, record_ingest_events
+from ingest_manifest import IngestManifest, IngestPlan, INGEST_MANIFEST_PATH
+from vitals_store import VitalsStore, VITALS_STORE_PATH, day_ordinal
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENV = os.getenv("PINECONE_ENV")  # e.g., "gcp-starter"
-INDEX_NAME = "elderly-health-agent"
-
-# Initialize Pinecone client
-pc = Pinecone(api_key=PINECONE_API_KEY)
-
-# Create index if it doesn't exist (512 for text-embedding-3-small)
-if INDEX_NAME not in pc.list_indexes().names():
-    pc.create_index(
-        name=INDEX_NAME,
-        dimension=1536,
-        metric="cosine",
-        spec=ServerlessSpec(
-            cloud="aws", 
-            region="us-east-1" 
+
+EMBED_BATCH_SIZE = 100
+UPSERT_BATCH_SIZE = 100
+MAX_WORKERS = 4
+MAX_RETRIES = 3
+
+# Text splitter
+splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+# One chunk ready for embedding: (vector_id, text, metadata)
+Chunk = Tuple[str, str, dict]
+
+
+def open_vector_store(embedding_model):
+    """Connect to the configured backend: a LocalVectorStore, or the Pinecone index (created if missing)"""
+    if VECTOR_STORE_BACKEND == "local":
+        # Local NumPy store on disk, no outside services besides embeddings
+        return LocalVectorStore(LOCAL_VECTOR_STORE_PATH, embedding_model)
+
+    # Initialize Pinecone client
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+
+    # Create index if it doesn't exist (512 for text-embedding-3-small)
+    if INDEX_NAME not in pc.list_indexes().names():
+        pc.create_index(
+            name=INDEX_NAME,
+            dimension=1536,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud="aws", 
+                region="us-east-1" 
+            )
         )
-    )
 
-# Connect to Pinecone index
-index = pc.Index(INDEX_NAME)
+    # Connect to Pinecone index
+    return pc.Index(INDEX_NAME)
 
-# Set up LangChain Pinecone vector store with correct embedding model
-embedding_model = OpenAIEmbeddings(model="text-embedding-3-small")
-vectorstore = PineconeVectorStore(index=index, embedding=embedding_model, text_key="text")
 
-# Text splitter
-splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=50)
+def upsert_vectors(target, ids: List[str], vectors: List[List[float]], texts: List[str], metadatas: List[dict]):
+    """Write precomputed embeddings to either backend; Pinecone keeps the chunk text under "text" like PineconeVectorStore"""
+    if isinstance(target, LocalVectorStore):
+        target.add_embeddings(ids, vectors, texts, metadatas)
+    else:
+        target.upsert(vectors=[
+            {"id": vector_id, "values": vector, "metadata": {**metadata, "text": text}}
+            for vector_id, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+        ])
+
+
+# One source record: (user_id, date, data_type, text)
+Record = Tuple[str, str, str, str]
+RECORD_FIELDS = ("user_id", "date", "data_type", "text")
+
+
+def iter_sample_records(daily_data: Dict[str, Dict[str, Dict[str, str]]]) -> Iterator[Record]:
+    """Flatten {user_id: {day: {data_type: text}}} into records"""
+    for user_id, day_data in daily_data.items():
+        for day, categories in day_data.items():
+            for data_type, content in categories.items():
+                yield user_id, day, data_type, content
+
+
+def _is_iso_date(value: str) -> bool:
+    """Exactly YYYY-MM-DD, the form day_ordinal() and the date filters expect"""
+    try:
+        return datetime.date.fromisoformat(value).isoformat() == value
+    except ValueError:
+        return False
+
+
+def read_records(path: str, fmt: str = None) -> Iterator[Record]:
+    """Stream records from a JSONL or CSV file ("-" for stdin), one row at a time.
+
+    The format comes from the file extension; `fmt` is used for stdin and other names.
+
+    Each row needs user_id, date (YYYY-MM-DD), data_type and text. Malformed rows are reported and skipped.
+    """
+    if path.lower().endswith(".csv"):
+        fmt = "csv"
+    elif path.lower().endswith((".jsonl", ".json")):
+        fmt = "jsonl"
+    fmt = fmt or "jsonl"
+    f = sys.stdin if path == "-" else open(path, "r", newline="", encoding="utf-8")
+    try:
+        rows = csv.DictReader(f) if fmt == "csv" else f
+        for line_number, row in enumerate(rows, start=1):
+            try:
+                if fmt != "csv":
+                    if not row.strip():
+                        continue
+                    row = json.loads(row)
+                # A short CSV row or a JSON null comes through as None: treat it as missing, not "None"
+                record = tuple("" if row[field] is None else str(row[field]).strip() for field in RECORD_FIELDS)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"[WARNING] Skipping malformed row {line_number} in {path}: {e}")
+                continue
+            if not all(record):
+                print(f"[WARNING] Skipping row {line_number} in {path}: empty field")
+                continue
+            if not _is_iso_date(record[1]):
+                print(f"[WARNING] Skipping row {line_number} in {path}: date '{record[1]}' is not YYYY-MM-DD")
+                continue
+            yield record
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def merge_duplicate_records(records: Iterable[Record]) -> Iterator[Record]:
+    """Give every (user_id, date, data_type) exactly one record, since the key fixes its vector IDs.
+
+    Consecutive rows for one key (e.g. several notes on a day in an EHR export) are joined
+    into one record, one line per row. A key that comes back after other records has
+    already been chunked, so that row is reported and skipped rather than overwriting the
+    earlier one's vectors; group an export's rows by key to have them merged.
+    """
+    seen = set()
+    pending = None
+    for record in records:
+        key = record[:3]
+        if pending is not None and key == pending[:3]:
+            pending = (*key, pending[3] + "\n" + record[3])
+            continue
+        if key in seen:
+            print(f"[WARNING] Skipping another {key[2]} record for {key[0]} on {key[1]}: rows for one key must be next to each other")
+            continue
+        if pending is not None:
+            yield pending
+        seen.add(key)
+        pending = record
+    if pending is not None:
+        yield pending
+
+
+def capture_vitals(records: Iterable[Record], store: VitalsStore, flush_every: int = 1000) -> Iterator[Record]:
+    """Pass records through unchanged while also parsing vitals records into the columnar store"""
+    pending = 0
+    for record in records:
+        user_id, day, data_type, content = record
+        if data_type == "vitals":
+            try:
+                if store.record(user_id, day, content):
+                    pending += 1
+            except ValueError as e:
+                print(f"[WARNING] Could not store vitals for {user_id} on {day}: {e}")
+            if pending >= flush_every:
+                store.flush()
+                pending = 0
+        yield record
+    store.flush()
+
+
+def iter_record_chunks(records: Iterable[Record]) -> Iterator[Chunk]:
+    """Split records into chunks with their vector IDs and metadata"""
+    for user_id, day, data_type, content in records:
+        chunks = splitter.split_text(content)
+        for i, chunk in enumerate(chunks):
+            metadata = {
+                "user_id": user_id,
+                "data_type": data_type,
+                "date": day,  # used for filtering in RAG
+                "date_ordinal": day_ordinal(day),  # numeric, for $gte/$lte range filters
+                "chunk_count": len(chunks)  # lets the ID fast path fetch every chunk of a long record
+            }
+            yield record_vector_id(user_id, data_type, day, i), chunk, metadata
+
+
+def iter_chunks(daily_data: Dict[str, Dict[str, Dict[str, str]]]) -> Iterator[Chunk]:
+    """Split {user_id: {day: {data_type: text}}} into chunks with their vector IDs and metadata"""
+    return iter_record_chunks(iter_sample_records(daily_data))
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestReport:
+    """Counters for one ingestion run, safe to update from worker threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.chunks = 0
+        self.deleted = 0
+        self.failed_chunks = 0
+        self.embed_batches = 0
+        self.upsert_batches = 0
+        self.failed_batches = 0
+        self.retries = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        rate = self.chunks / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{self.chunks} records in {elapsed:.1f}s ({rate:.1f} records/sec), {self.deleted} deleted, "
+            f"{self.embed_batches} embed batches, {self.upsert_batches} upsert batches, "
+            f"{self.retries} retries, {self.failed_batches} failed batches ({self.failed_chunks} records)"
+        )
+
+
+def _with_retries(action, description: str, report: IngestReport, max_retries: int):
+    """Run action(), retrying with exponential backoff and jitter"""
+    for attempt in range(max_retries + 1):
+        try:
+            return action()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = min(2 ** attempt, 30) + random.uniform(0, 0.5)
+            print(f"[WARNING] {description} failed ({e}); retrying in {delay:.1f}s")
+            report.add(retries=1)
+            time.sleep(delay)
+
+
+def _ingest_batch(batch: List[Chunk], target, embedding_model, upsert_batch_size: int, report: IngestReport, max_retries: int, on_written=None):
+    ids = [vector_id for vector_id, _, _ in batch]
+    texts = [text for _, text, _ in batch]
+    metadatas = [metadata for _, _, metadata in batch]
+    try:
+        vectors = _with_retries(lambda: embedding_model.embed_documents(texts), f"Embedding batch starting at {ids[0]}", report, max_retries)
+    except Exception as e:
+        print(f"[ERROR] Giving up on embedding batch starting at {ids[0]}: {e}")
+        report.add(failed_batches=1, failed_chunks=len(batch))
+        return
+    report.add(embed_batches=1)
+
+    for start in range(0, len(batch), upsert_batch_size):
+        end = start + upsert_batch_size
+        try:
+            _with_retries(
+                lambda: upsert_vectors(target, ids[start:end], vectors[start:end], texts[start:end], metadatas[start:end]),
+                f"Upsert batch starting at {ids[start]}", report, max_retries
+            )
+        except Exception as e:
+            print(f"[ERROR] Giving up on upsert batch starting at {ids[start]}: {e}")
+            report.add(failed_batches=1, failed_chunks=len(ids[start:end]))
+            continue
+        report.add(upsert_batches=1, chunks=len(ids[start:end]))
+        record_ingest_events(sorted({(m["user_id"], m["date"], m["data_type"]) for m in metadatas[start:end]}))
+        if on_written:
+            on_written(batch[start:end])
+
+
+def ingest_chunks(chunks: Iterable[Chunk], target, embedding_model, embed_batch_size: int = EMBED_BATCH_SIZE,
+                  upsert_batch_size: int = UPSERT_BATCH_SIZE, max_workers: int = MAX_WORKERS,
+                  max_retries: int = MAX_RETRIES, on_written=None) -> IngestReport:
+    """Embed and upsert chunks in batches on a bounded pool.
+
+    At most 2 * max_workers batches are in flight, so `chunks` can be a lazy iterator of any
+    length. A batch that still fails after max_retries is reported and skipped.
+    on_written(chunks) is called after every upsert that succeeded.
+    """
+    report = IngestReport()
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest") as executor:
+        for batch in batched(chunks, embed_batch_size):
+            if len(in_flight) >= 2 * max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            in_flight.add(executor.submit(
+                _ingest_batch, batch, target, embedding_model, upsert_batch_size, report, max_retries, on_written
+            ))
+        for future in in_flight:
+            future.result()
+    return report
+
 
 daily_sample_data = {
     "user_mary": {
@@ -197,17 +466,115 @@ daily_sample_data = {
     }
 }
 
-# Ingest into Pinecone
-for user_id, day_data in daily_sample_data.items():
-    for day, categories in day_data.items():
-        for data_type, content in categories.items():
-            chunks = splitter.split_text(content)
-            for i, chunk in enumerate(chunks):
-                metadata = {
-                    "user_id": user_id,
-                    "data_type": data_type,
-                    "date": day  # used for filtering in RAG
-                }
-                vectorstore.add_texts([chunk], metadatas=[metadata], ids=[f"{user_id}_{data_type}_{day}_{i}"])
-
-print("✅ Multi-day ingestion complete.")
+def delete_vectors(target, ids: List[str], report: IngestReport, batch_size: int = UPSERT_BATCH_SIZE,
+                   max_retries: int = MAX_RETRIES) -> List[str]:
+    """Delete vectors in batches with retries; returns the IDs that were actually deleted"""
+    deleted = []
+    for batch in batched(ids, batch_size):
+        try:
+            _with_retries(lambda: target.delete(ids=batch), f"Delete batch starting at {batch[0]}", report, max_retries)
+        except Exception as e:
+            print(f"[ERROR] Giving up on delete batch starting at {batch[0]}: {e}")
+            report.add(failed_batches=1)
+            continue
+        report.add(deleted=len(batch))
+        deleted.extend(batch)
+    return deleted
+
+
+def delete_vitals_days(keys: Iterable[Tuple[str, str, str]], manifest: IngestManifest, vitals: VitalsStore):
+    """Remove the days of vitals records that no longer have any vectors (pruned or otherwise deleted)"""
+    removed = 0
+    for user_id, day, data_type in keys:
+        if data_type == "vitals" and not manifest.has_record((user_id, day, data_type)):
+            removed += vitals.delete_day(user_id, day)
+    if removed:
+        vitals.flush()
+        print(f"🗑️ Removed {removed} deleted day(s) from the vitals store")
+
+
+def run_incremental(chunks: Iterable[Chunk], manifest: IngestManifest, target, embedding_model,
+                    dry_run: bool = False, prune: bool = False, force: bool = False,
+                    vitals: VitalsStore = None, **ingest_kwargs) -> IngestReport:
+    """Embed only new or changed chunks, delete vectors for removed ones, and update the manifest.
+
+    With dry_run the input is only diffed against the manifest and the planned changes printed.
+    force re-embeds every chunk regardless of its hash. Vitals records that are deleted
+    entirely are also removed from `vitals`, so their days stop showing up in trends.
+    """
+    plan = IngestPlan(prune=prune)
+    changed = manifest.diff(chunks, plan, force=force)
+    if dry_run:
+        to_write = list(changed)
+        stale = manifest.stale_ids(plan)
+        print(f"📝 Dry run: {plan.summary(stale)}")
+        for vector_id, _, _ in to_write:
+            print(f"   upsert {vector_id}")
+        for vector_id in stale:
+            print(f"   delete {vector_id}")
+        return IngestReport()
+
+    dropped = compact_ingest_events()
+    if dropped:
+        print(f"🧹 Dropped {dropped} expired event(s) from the ingest events log")
+    report = ingest_chunks(changed, target, embedding_model, on_written=manifest.mark_written, **ingest_kwargs)
+    stale = manifest.stale_ids(plan)
+    print(f"📝 {plan.summary(stale)}")
+    if stale:
+        keys = manifest.record_keys(stale)
+        deleted = delete_vectors(target, stale, report, max_retries=ingest_kwargs.get("max_retries", MAX_RETRIES))
+        manifest.mark_deleted(deleted)
+        if vitals is not None:
+            delete_vitals_days(keys, manifest, vitals)
+        record_ingest_events(keys)
+    manifest.save()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed and upsert health records into the vector store.")
+    parser.add_argument("inputs", nargs="*", help="JSONL or CSV files of user_id/date/data_type/text records ('-' for stdin); defaults to the built-in sample data")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="format for stdin and files without a .csv/.jsonl extension (default: jsonl)")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="texts per embedding request")
+    parser.add_argument("--upsert-batch-size", type=int, default=UPSERT_BATCH_SIZE, help="vectors per upsert request")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="batches processed concurrently")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES, help="retries per failed batch")
+    parser.add_argument("--manifest", default=INGEST_MANIFEST_PATH, help="content-hash manifest used to skip unchanged records")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-embed everything")
+    parser.add_argument("--prune", action="store_true", help="delete every previously ingested vector not in this input")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be upserted and deleted")
+    parser.add_argument("--vitals-store", default=VITALS_STORE_PATH, help="directory of the columnar vitals store")
+    args = parser.parse_args()
+
+    embedding_model = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    target = None if args.dry_run else open_vector_store(embedding_model)
+    manifest = IngestManifest(args.manifest, EMBEDDING_MODEL)
+    if args.inputs:
+        # parse -> split -> (diff -> batch -> embed -> upsert) all as lazy generators
+        records = merge_duplicate_records(
+            record for path in args.inputs for record in read_records(path, args.format)
+        )
+    else:
+        records = iter_sample_records(daily_sample_data)
+    vitals = None if args.dry_run else VitalsStore(args.vitals_store)
+    if vitals is not None:
+        records = capture_vitals(records, vitals)
+    report = run_incremental(
+        iter_record_chunks(records), manifest, target, embedding_model,
+        dry_run=args.dry_run,
+        prune=args.prune,
+        force=args.full,
+        vitals=vitals,
+        embed_batch_size=args.embed_batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        max_workers=args.workers,
+        max_retries=args.max_retries
+    )
+    if args.dry_run:
+        return
+    print(f"📊 {report.summary()}")
+    print("✅ Multi-day ingestion complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import string
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# Keyword lists per intent. Matching is case-insensitive substring matching, the same
+# semantics as `keyword in message.lower()`, so "hurt" also matches "hurting".
+MESSAGE_KEYWORDS = {
+    "symptom": [
+        "pain", "hurt", "ache", "dizzy", "dizziness", "light-headed", "lightheaded",
+        "tight", "pressure", "nausea", "breath", "breathing", "faint", "bleeding",
+        "vomit", "palpitation", "arrhythmia", "cramp", "chest", "heart"
+    ],
+    # Wider list used to write a booking reason from the user's own words
+    "booking_symptom": [
+        "pain", "hurt", "ache", "dizzy", "tight", "pressure", "nausea", "breath", "faint", "bleeding",
+        "vomit", "palpitation", "arrhythmia", "cramp", "chest", "heart", "headache", "memory", "nerve",
+        "stroke", "seizure", "mobility", "balance", "fall", "chronic", "diabetes"
+    ],
+    "appointment": [
+        "appointment", "book", "schedule", "see doctor", "see a doctor", "make appointment",
+        "need to see", "want to see", "doctor visit", "medical appointment", "consultation"
+    ],
+    "slot_selection": [
+        "slot", "choose", "select", "want slot", "pick slot", "book slot", "number", "option"
+    ],
+    # Questions about how things have been going over several days
+    "trend": [
+        "trend", "lately", "recently", "this week", "past week", "last week", "this month",
+        "past month", "getting worse", "getting better", "over time", "improving"
+    ],
+    # User says help has arrived or they are okay, ending an active emergency
+    "emergency_clear": [
+        "help arrived", "paramedics", "ambulance", "i'm fine", "i am fine", "feel better",
+        "i'm okay", "im okay", "i feel okay"
+    ],
+    "says_yes": ["yes"],
+    "says_no": ["no"],
+    # Replies that accept the emergency call offer
+    "emergency_request": ["yes", "call", "contact", "please"],
+    "food": ["food", "meal", "diet", "breakfast", "lunch", "dinner"],
+    "vitals": ["vitals", "heart", "blood pressure", "oxygen", "pulse", "steps", "step count"],
+    "medical_record": ["medical", "diagnosis", "record", "history", "prescribed", "medication"],
+}
+
+# Phrases in the agent's own reply that mark its severity conclusion
+SEVERITY_KEYWORDS = {
+    "serious": [
+        "critical", "urgent", "emergency",
+        "call doctor immediately", "dangerous", "alarming",
+        "seek medical attention", "emergency room",
+        # The original list was missing two commas, so these pairs only ever matched as one
+        # run-together phrase. Kept as-is here so triage behaviour doesn't change.
+        "heart-related symptoms", "require immediate medical attentionhigh blood pressure",
+        "low oxygen", "symptoms can be serioustachycardia", "hypertension", "call 911",
+        "see a doctor immediately", "abnormal readings", "require immediate attention"
+    ],
+    "mild": [
+        "rest", "mild", "appears to be mild", "seems mild", "not serious", "minor",
+        "within normal range", "stay hydrated", "take a break", "dizziness", "stable condition",
+        "no immediate concern", "routine", "minor issue"
+    ],
+}
+
+# Whole-message replies to a yes/no confirmation prompt, after normalize_confirmation
+CONFIRMATION_YES = {"yes", "y", "confirm", "ok", "okay", "s", "sure", "yes sure"}
+CONFIRMATION_NO = {"no", "n", "not ok", "not okay"}
+
+
+class KeywordMatch(NamedTuple):
+    label: str
+    keyword: str
+    start: int
+    end: int
+
+
+def normalize_confirmation(msg: str) -> str:
+    return msg.strip().lower().strip(string.punctuation)
+
+
+class Classification:
+    """Everything one scan of a text found: matches in text order, grouped by label"""
+
+    def __init__(self, text: str, matches: List[KeywordMatch]):
+        self.text = text
+        self.matches = matches
+        self.labels = {match.label for match in matches}
+        self.has_digit = any(ch.isdigit() for ch in text)
+        self.normalized = normalize_confirmation(text)
+
+    def has(self, label: str) -> bool:
+        return label in self.labels
+
+    def keywords(self, label: str) -> List[str]:
+        """Distinct matched keywords for a label, in order of first appearance"""
+        return list(dict.fromkeys(match.keyword for match in self.matches if match.label == label))
+
+    def spans(self, label: str) -> List[KeywordMatch]:
+        return [match for match in self.matches if match.label == label]
+
+    @property
+    def confirmation(self) -> Optional[str]:
+        """"yes" or "no" when the whole message is a confirmation reply, else None"""
+        if self.normalized in CONFIRMATION_YES:
+            return "yes"
+        if self.normalized in CONFIRMATION_NO:
+            return "no"
+        return None
+
+
+class KeywordClassifier:
+    """Aho–Corasick automaton over labelled keyword lists.
+
+    Built once; classify() lower-cases the text once and walks it in a single pass,
+    reporting every (overlapping) keyword occurrence with its label and span.
+    """
+
+    def __init__(self, keywords_by_label: Dict[str, Iterable[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[tuple]] = [[]]
+        for label, keywords in keywords_by_label.items():
+            for keyword in keywords:
+                self._add(label, keyword.lower())
+        self._build_failure_links()
+
+    def _add(self, label: str, keyword: str):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if (label, keyword) not in self._out[state]:
+            self._out[state].append((label, keyword))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # A state also reports everything its longest proper suffix reports
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def classify(self, text: str) -> Classification:
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        state = 0
+        for i, ch in enumerate((text or "").lower()):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for label, keyword in out[state]:
+                matches.append(KeywordMatch(label, keyword, i - len(keyword) + 1, i + 1))
+        return Classification(text or "", matches)
+
+
+message_classifier = KeywordClassifier(MESSAGE_KEYWORDS)
+severity_classifier = KeywordClassifier(SEVERITY_KEYWORDS)
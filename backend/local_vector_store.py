@@ -0,0 +1,336 @@
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Metadata fields with an inverted index; filters on these only score the matching rows
+INDEXED_FIELDS = ("user_id", "date", "data_type")
+
+VECTORS_FILE = "vectors.f32"
+LOG_FILE = "records.jsonl"
+# Dead rows (overwritten or deleted) tolerated before compacting, when they also outnumber live rows
+COMPACT_MIN_DEAD_ROWS = 1024
+
+
+def _matches(value, condition) -> bool:
+    """Check one metadata value against a Pinecone-style condition ({"$eq": x}, {"$in": [...]}, or a bare value)"""
+    if not isinstance(condition, dict):
+        return value == condition
+    for op, operand in condition.items():
+        if op == "$eq" and not value == operand:
+            return False
+        if op == "$ne" and not value != operand:
+            return False
+        if op == "$in" and value not in operand:
+            return False
+        if op == "$nin" and value in operand:
+            return False
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is None:
+                return False
+            if op == "$gt" and not value > operand:
+                return False
+            if op == "$gte" and not value >= operand:
+                return False
+            if op == "$lt" and not value < operand:
+                return False
+            if op == "$lte" and not value <= operand:
+                return False
+    return True
+
+
+def _indexed_values(condition) -> Optional[set]:
+    """Values an equality/membership condition can take, or None if it needs a per-row check"""
+    try:
+        if not isinstance(condition, dict):
+            return {condition}
+        if not condition or set(condition) - {"$eq", "$in"}:
+            return None
+        values = {condition["$eq"]} if "$eq" in condition else None
+        if "$in" in condition:
+            in_values = set(condition["$in"])
+            values = in_values if values is None else values & in_values
+        return values
+    except TypeError:
+        # Unhashable operand
+        return None
+
+
+class LocalVectorStore(VectorStore):
+    """NumPy-backed vector store persisted to a local directory.
+
+    Embeddings are stored L2-normalised in a raw float32 file that is memory-mapped, so
+    cosine similarity is a plain dot product. Texts and metadata live in a JSON-lines log
+    next to it. Both files are append-only: an upsert appends its vectors and one "put"
+    line per ID (an overwrite just points the ID at a new row), a delete appends "del"
+    lines, so each write costs I/O proportional to the batch. Once dead rows outnumber
+    live ones the store is compacted into fresh files.
+
+    Other processes (e.g. ingest_rag_data.py writing while the server reads) are picked
+    up on the next read: new log lines are replayed, and a compaction triggers a full
+    reload. Only one process should write at a time.
+
+    user_id, date and data_type get an inverted index, and filtered searches only score
+    the rows that survive those filters. Filters use the same syntax as the Pinecone path
+    ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte).
+    """
+
+    def __init__(self, path: str, embedding: Embeddings):
+        self.path = path
+        self.embedding = embedding
+        self._lock = threading.RLock()
+        self._vectors_path = os.path.join(path, VECTORS_FILE)
+        self._log_path = os.path.join(path, LOG_FILE)
+        self._reset()
+        self._refresh()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    # --- persistence ---
+
+    def _reset(self):
+        self._row_ids: List[Optional[str]] = []  # per row; None once the row is dead
+        self._texts: List[Optional[str]] = []
+        self._metadatas: List[Optional[dict]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[Any, Set[int]]] = {field: {} for field in INDEXED_FIELDS}
+        self._vectors: Optional[np.ndarray] = None
+        self._dim: Optional[int] = None
+        self._log_offset = 0
+        self._log_inode = None
+
+    def _index(self, row: int, metadata: dict):
+        for field in INDEXED_FIELDS:
+            if field in metadata:
+                self._postings[field].setdefault(metadata[field], set()).add(row)
+
+    def _unindex(self, row: int):
+        for field in INDEXED_FIELDS:
+            value = self._metadatas[row].get(field)
+            rows = self._postings[field].get(value)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._postings[field][value]
+
+    def _kill(self, vector_id: str):
+        row = self._id_to_row.pop(vector_id, None)
+        if row is not None:
+            self._unindex(row)
+            self._row_ids[row] = self._texts[row] = self._metadatas[row] = None
+
+    def _apply(self, entry: dict):
+        """Replay one log line into the in-memory state"""
+        self._kill(entry["id"])
+        if entry["op"] == "put":
+            row = entry["row"]
+            while len(self._row_ids) <= row:
+                self._row_ids.append(None)
+                self._texts.append(None)
+                self._metadatas.append(None)
+            self._row_ids[row] = entry["id"]
+            self._texts[row] = entry["text"]
+            self._metadatas[row] = entry["metadata"]
+            self._id_to_row[entry["id"]] = row
+            self._index(row, entry["metadata"])
+            self._dim = self._dim or entry.get("dim")
+
+    def _map_vectors(self):
+        rows = len(self._row_ids)
+        self._vectors = (
+            np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+            if rows and self._dim else None
+        )
+
+    def _refresh(self):
+        """Replay log lines written since the last read; reload everything after a compaction"""
+        with self._lock:
+            try:
+                stat = os.stat(self._log_path)
+            except FileNotFoundError:
+                if self._log_inode is not None:
+                    self._reset()
+                return
+            if stat.st_ino != self._log_inode or stat.st_size < self._log_offset:
+                self._reset()
+                self._log_inode = stat.st_ino
+            if stat.st_size == self._log_offset:
+                return
+            with open(self._log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+            # A writer may be mid-line; only replay complete lines
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                if line.strip():
+                    self._apply(json.loads(line))
+            self._log_offset += len(complete)
+            self._map_vectors()
+
+    def _append(self, vectors: np.ndarray, entries: List[dict]):
+        """Append vector rows, then the log lines that reference them, then replay them locally"""
+        os.makedirs(self.path, exist_ok=True)
+        if len(vectors):
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._log_path, "ab") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8"))
+        self._refresh()
+
+    def _next_row(self) -> int:
+        if self._dim is None or not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (4 * self._dim)
+
+    def _maybe_compact(self):
+        live = len(self._id_to_row)
+        dead = len(self._row_ids) - live
+        if dead > max(live, COMPACT_MIN_DEAD_ROWS):
+            self.compact()
+
+    def compact(self):
+        """Rewrite both files with only the live rows and swap them in"""
+        with self._lock:
+            self._refresh()
+            live_rows = sorted(self._id_to_row.values())
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._vectors_path + ".tmp", "wb") as f:
+                for start in range(0, len(live_rows), 4096):
+                    f.write(np.ascontiguousarray(self._vectors[live_rows[start:start + 4096]]).tobytes())
+            with open(self._log_path + ".tmp", "w") as f:
+                for new_row, row in enumerate(live_rows):
+                    f.write(json.dumps({
+                        "op": "put", "id": self._row_ids[row], "row": new_row, "dim": self._dim,
+                        "text": self._texts[row], "metadata": self._metadatas[row],
+                    }) + "\n")
+            # Vectors first: a reader that sees the new log always finds its rows
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            os.replace(self._log_path + ".tmp", self._log_path)
+            self._reset()
+            self._refresh()
+
+    # --- writes ---
+
+    def add_embeddings(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]], texts: Sequence[str], metadatas: Sequence[dict]) -> List[str]:
+        """Upsert precomputed embeddings; an ID repeated within the call keeps its last value, like Pinecone"""
+        if not ids:
+            return []
+        new_vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(new_vectors, axis=1, keepdims=True)
+        new_vectors = new_vectors / np.where(norms == 0, 1, norms)
+        last = {vector_id: position for position, vector_id in enumerate(ids)}
+        positions = sorted(last.values())
+        with self._lock:
+            self._refresh()
+            if self._dim is not None and new_vectors.shape[1] != self._dim:
+                raise ValueError(f"Expected {self._dim}-dimensional embeddings, got {new_vectors.shape[1]}")
+            self._dim = new_vectors.shape[1]
+            first_row = self._next_row()
+            entries = [
+                {"op": "put", "id": ids[position], "row": first_row + offset, "dim": self._dim,
+                 "text": texts[position], "metadata": dict(metadatas[position])}
+                for offset, position in enumerate(positions)
+            ]
+            self._append(new_vectors[positions], entries)
+            self._maybe_compact()
+        return list(ids)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        embeddings = self.embedding.embed_documents(texts)
+        return self.add_embeddings(ids, embeddings, texts, metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            self._refresh()
+            present = [vector_id for vector_id in dict.fromkeys(ids) if vector_id in self._id_to_row]
+            if not present:
+                return False
+            self._append(np.empty((0, self._dim or 0), dtype=np.float32), [{"op": "del", "id": i} for i in present])
+            self._maybe_compact()
+        return True
+
+    # --- reads ---
+
+    def _candidate_rows(self, metadata_filter: Optional[dict]) -> np.ndarray:
+        """Live rows matching the filter: indexed fields narrow via postings, the rest are checked per row"""
+        if not metadata_filter:
+            return np.asarray(sorted(self._id_to_row.values()), dtype=np.int64)
+        candidates = None
+        residual = {}
+        for field, condition in metadata_filter.items():
+            values = _indexed_values(condition) if field in self._postings else None
+            if values is None:
+                residual[field] = condition
+                continue
+            rows = set()
+            for value in values:
+                rows.update(self._postings[field].get(value, ()))
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return np.arange(0)
+        rows = sorted(candidates) if candidates is not None else sorted(self._id_to_row.values())
+        if residual:
+            rows = [
+                row for row in rows
+                if all(_matches(self._metadatas[row].get(field), condition) for field, condition in residual.items())
+            ]
+        return np.asarray(list(rows), dtype=np.int64)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        with self._lock:
+            self._refresh()
+            rows = self._candidate_rows(filter)
+            if len(rows) == 0 or self._vectors is None or k <= 0:
+                return []
+            scores = np.asarray(self._vectors[rows]) @ query
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._document(int(rows[i])), float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    def get_documents(self, ids: Sequence[str]) -> Dict[str, Document]:
+        """Direct lookup by vector ID; missing IDs are left out of the result"""
+        with self._lock:
+            self._refresh()
+            return {i: self._document(self._id_to_row[i]) for i in ids if i in self._id_to_row}
+
+    def _document(self, row: int) -> Document:
+        return Document(page_content=self._texts[row], metadata=dict(self._metadatas[row]))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._id_to_row)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, path: str = "vector_store", ids: Optional[List[str]] = None, **kwargs: Any) -> "LocalVectorStore":
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,368 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+# "memory" keeps sessions in this process; "sqlite" shares them between worker processes
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "memory").lower()
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+# In-memory sessions: at most SESSION_MAX_ENTRIES, each dropped after SESSION_IDLE_TTL seconds unused.
+# With SESSION_SPILL_PATH set, dropped sessions go to that SQLite file and come back on the next message.
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", "10000"))
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "86400"))
+SESSION_SPILL_PATH = os.environ.get("SESSION_SPILL_PATH")
+# SQLite sessions: how long a turn may hold a user's lock before other workers may take it
+# (covers a worker that died mid-turn), and how long a turn waits for the lock
+SESSION_LOCK_TTL = float(os.environ.get("SESSION_LOCK_TTL", "300"))
+SESSION_LOCK_TIMEOUT = float(os.environ.get("SESSION_LOCK_TIMEOUT", "120"))
+
+_MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage}
+
+
+def _default_emergency() -> Dict:
+    return {"active": False, "reason": None}
+
+
+class UserSession:
+    """Everything the agent remembers about one user between messages"""
+
+    def __init__(self, memory, greeted: bool = False, emergency: Optional[Dict] = None,
+                 pending_appointment: Optional[Dict] = None, pending_slots: Optional[List[Dict]] = None):
+        self.memory = memory
+        self.greeted = greeted
+        self.emergency = emergency or _default_emergency()
+        self.pending_appointment = pending_appointment  # {'slot_number', 'slot_details', 'reason', 'summary'}
+        self.pending_slots = pending_slots  # slots last shown to the user
+
+    def reset_conversation(self, memory):
+        """New session: fresh memory, greet again, no emergency. Pending bookings survive."""
+        self.memory = memory
+        self.greeted = False
+        self.emergency = _default_emergency()
+
+
+def dump_session(session: UserSession) -> bytes:
+    """Compact form of a session: only message types and text, the running summary, and pending state"""
+    memory = session.memory
+    data = {
+        "greeted": session.greeted,
+        "emergency": session.emergency,
+        "pending_appointment": session.pending_appointment,
+        "pending_slots": session.pending_slots,
+        "summary": memory.moving_summary_buffer,
+        "messages": [[message.type, message.content] for message in memory.chat_memory.messages],
+    }
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def load_session(blob: bytes, memory_factory: Callable) -> UserSession:
+    data = json.loads(zlib.decompress(blob).decode("utf-8"))
+    memory = memory_factory()
+    memory.moving_summary_buffer = data["summary"]
+    memory.chat_memory.messages = [
+        _MESSAGE_TYPES[message_type](content=content) for message_type, content in data["messages"]
+    ]
+    return UserSession(memory, data["greeted"], data["emergency"], data["pending_appointment"], data["pending_slots"])
+
+
+class SessionLock:
+    """A held per-user turn lock; release() is safe to call more than once"""
+
+    def __init__(self, release: Optional[Callable[[], None]] = None):
+        self._release = release
+
+    def release(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class SessionStore(ABC):
+    """Where per-user sessions and undelivered follow-ups live.
+
+    The agent takes the user's lock(), loads the session at the start of a turn, saves it
+    at the end and releases the lock, so any change made in between (including in-place
+    ones) is written back on save without another turn for the user overwriting it.
+    """
+
+    def __init__(self, memory_factory: Callable):
+        self.memory_factory = memory_factory
+
+    def new_session(self) -> UserSession:
+        return UserSession(self.memory_factory())
+
+    def lock(self, user_id: str) -> SessionLock:
+        """Hold the user's session for one turn. In one process every turn already shares the
+        same live session object, so the base version doesn't lock anything."""
+        return SessionLock()
+
+    @abstractmethod
+    def load(self, user_id: str) -> UserSession:
+        """The user's session, or a new one"""
+
+    @abstractmethod
+    def save(self, user_id: str, session: UserSession):
+        ...
+
+    @abstractmethod
+    def delete(self, user_id: str):
+        ...
+
+    @abstractmethod
+    def push_followup(self, user_id: str, text: str):
+        ...
+
+    @abstractmethod
+    def pop_followups(self, user_id: str) -> List[str]:
+        """Undelivered follow-ups for the user, oldest first, removed from the store"""
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessions as live objects in this process (single worker), bounded by LRU + idle TTL.
+
+    Sessions are kept in least-recently-used order, so the idle ones are always at the
+    front and are swept from there on every load/save. Evicted sessions are dropped, or
+    moved to `spill` (a SQLiteSessionStore) and taken back from it on the user's next
+    message.
+    """
+
+    def __init__(self, memory_factory: Callable, max_entries: int = SESSION_MAX_ENTRIES,
+                 idle_ttl: float = SESSION_IDLE_TTL, spill: Optional["SQLiteSessionStore"] = None):
+        super().__init__(memory_factory)
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.spill = spill
+        self._sessions: "OrderedDict[str, Tuple[float, UserSession]]" = OrderedDict()
+        self._followups: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._miss_lock = threading.Lock()
+        self.expirations = 0
+        self.evictions = 0
+        self.spilled = 0
+        self.rehydrated = 0
+
+    def _touch(self, user_id: str) -> Optional[UserSession]:
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                return None
+            self._sessions[user_id] = (time.monotonic(), entry[1])
+            self._sessions.move_to_end(user_id)
+            return entry[1]
+
+    def load(self, user_id: str) -> UserSession:
+        session = self._touch(user_id)
+        if session is not None:
+            return session
+        # Misses are serialised so two requests can't both create (or rehydrate) the same user
+        with self._miss_lock:
+            session = self._touch(user_id)
+            if session is not None:
+                return session
+            session = self.spill.take(user_id) if self.spill is not None else None
+            if session is not None:
+                self.rehydrated += 1
+                print(f"[DEBUG] Rehydrated spilled session for user: {user_id}")
+            else:
+                session = self.new_session()
+                print(f"[DEBUG] Created new session for user: {user_id}")
+            self.save(user_id, session)
+            return session
+
+    def save(self, user_id: str, session: UserSession):
+        with self._lock:
+            self._sessions[user_id] = (time.monotonic(), session)
+            self._sessions.move_to_end(user_id)
+            evicted = self._evict()
+        self._spill(evicted)
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+        if self.spill is not None:
+            self.spill.delete(user_id)
+
+    def push_followup(self, user_id: str, text: str):
+        with self._lock:
+            self._followups.setdefault(user_id, []).append(text)
+
+    def pop_followups(self, user_id: str) -> List[str]:
+        with self._lock:
+            return self._followups.pop(user_id, [])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "spilled": self.spilled,
+                "rehydrated": self.rehydrated,
+            }
+
+    def _evict(self) -> List[Tuple[str, UserSession]]:
+        """Pop idle and over-limit sessions (caller holds the lock); returns them for spilling"""
+        evicted = []
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            user_id, (last_used, session) = next(iter(self._sessions.items()))
+            if last_used <= cutoff:
+                self.expirations += 1
+            elif len(self._sessions) > self.max_entries:
+                self.evictions += 1
+            else:
+                break
+            del self._sessions[user_id]
+            evicted.append((user_id, session))
+        return evicted
+
+    def _spill(self, evicted: List[Tuple[str, UserSession]]):
+        if self.spill is None:
+            return
+        for user_id, session in evicted:
+            try:
+                self.spill.save(user_id, session)
+                self.spilled += 1
+            except Exception as e:
+                print(f"[WARNING] Could not spill session for {user_id}: {e}")
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions serialised into a SQLite file, so several worker processes can share them.
+
+    Follow-ups are rows of their own, so a worker delivering them never overwrites a
+    session another worker is saving. Turns for one user are serialised across workers by
+    lock(), a lease row per user, so two workers can't both load the same session and have
+    the later save drop the other's changes.
+    """
+
+    def __init__(self, memory_factory: Callable, path: str = SESSION_DB_PATH):
+        super().__init__(memory_factory)
+        self.path = path
+        self._local = threading.local()
+        # Lease owners are "<this store's id>:<turn id>"; the turns of this process still
+        # holding theirs are in _held, so one that was dropped unreleased is known to be abandoned
+        self._id = uuid.uuid4().hex
+        self._held: "weakref.WeakValueDictionary[str, SessionLock]" = weakref.WeakValueDictionary()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (user_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS followups (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, text TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS followups_user ON followups (user_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS session_locks (user_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers in other processes carry on during writes"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def lock(self, user_id: str, ttl: float = SESSION_LOCK_TTL, timeout: float = SESSION_LOCK_TIMEOUT) -> SessionLock:
+        """Wait for the user's lease (or one left to expire by a dead worker) and take it.
+
+        A lease this process took for a turn that was dropped without releasing it is taken
+        over at once rather than waited out. The lease is also released if its SessionLock
+        is garbage collected unreleased.
+        """
+        owner = f"{self._id}:{uuid.uuid4().hex}"
+        # Registered before the lease row exists, so other threads never see it as abandoned
+        session_lock = SessionLock(lambda: self._release(user_id, owner, finalizer))
+        finalizer = weakref.finalize(session_lock, self._unlock, user_id, owner)
+        self._held[owner] = session_lock
+        deadline = time.monotonic() + timeout
+        delay = 0.02
+        while True:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT owner, expires_at FROM session_locks WHERE user_id = ?", (user_id,)).fetchone()
+                if row is None or row[1] < time.time() or self._abandoned(row[0]):
+                    if row is not None and row[1] >= time.time():
+                        print(f"[WARNING] Taking over the session lock of an abandoned turn for {user_id}")
+                    conn.execute(
+                        "INSERT OR REPLACE INTO session_locks (user_id, owner, expires_at) VALUES (?, ?, ?)",
+                        (user_id, owner, time.time() + ttl),
+                    )
+                    return session_lock
+            if time.monotonic() >= deadline:
+                finalizer.detach()
+                self._held.pop(owner, None)
+                raise TimeoutError(f"Session for {user_id} is still busy with another turn")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def _abandoned(self, owner: str) -> bool:
+        return owner.startswith(f"{self._id}:") and owner not in self._held
+
+    def _release(self, user_id: str, owner: str, finalizer: weakref.finalize):
+        finalizer.detach()
+        self._held.pop(owner, None)
+        self._unlock(user_id, owner)
+
+    def _unlock(self, user_id: str, owner: str):
+        # Only our own lease: if it expired and another worker took it, that one stays
+        with self._connect() as conn:
+            conn.execute("DELETE FROM session_locks WHERE user_id = ? AND owner = ?", (user_id, owner))
+
+    def load(self, user_id: str) -> UserSession:
+        row = self._connect().execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            print(f"[DEBUG] Created new session for user: {user_id}")
+            return self.new_session()
+        return load_session(row[0], self.memory_factory)
+
+    def save(self, user_id: str, session: UserSession):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, dump_session(session), time.time()),
+            )
+
+    def delete(self, user_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def take(self, user_id: str) -> Optional[UserSession]:
+        """Remove and return a stored session, or None (used to rehydrate spilled sessions)"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        return load_session(row[0], self.memory_factory) if row is not None else None
+
+    def push_followup(self, user_id: str, text: str):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO followups (user_id, text) VALUES (?, ?)", (user_id, text))
+
+    def pop_followups(self, user_id: str) -> List[str]:
+        conn = self._connect()
+        with conn:
+            # Take the write lock before reading so two workers can't both deliver the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, text FROM followups WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
+            if rows:
+                conn.execute("DELETE FROM followups WHERE user_id = ? AND id <= ?", (user_id, rows[-1][0]))
+        return [text for _, text in rows]
+
+
+def create_session_store(memory_factory: Callable, backend: str = SESSION_STORE_BACKEND) -> SessionStore:
+    if backend == "sqlite":
+        return SQLiteSessionStore(memory_factory)
+    if backend != "memory":
+        print(f"[WARNING] Unknown SESSION_STORE_BACKEND '{backend}', keeping sessions in memory")
+    spill = SQLiteSessionStore(memory_factory, SESSION_SPILL_PATH) if SESSION_SPILL_PATH else None
+    return InMemorySessionStore(memory_factory, spill=spill)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Regression checks for date_extraction: month names must only match as whole words, and
+plain numbers in a "from ... to ..." sentence must not become a date range
+"""
+
+import datetime
+
+from date_extraction import _DATE_HINT, extract_date, extract_date_range
+
+TODAY = datetime.date(2024, 7, 15)
+
+CASES = [
+    ("I ate 2 apricots yesterday", "2024-07-14"),
+    ("2 decaf coffees today", "2024-07-15"),
+    ("3 junk snacks this morning", "2024-07-15"),
+    ("I ran 2 marathons last week", "2024-07-08"),
+    ("My blood pressure on Apr 2", "2024-04-02"),
+    ("3rd of March", "2024-03-03"),
+    ("Dec. 5, 2023", "2023-12-05"),
+    ("June 3rd", "2024-06-03"),
+]
+
+# Words that only contain a month abbreviation must not send text to the dateparser fallback
+NO_HINT = ["I ate junk food", "a decaf coffee", "we went marching", "my mother called"]
+
+RANGE_CASES = [
+    ("my pain went from 5 to 8", None),
+    ("from 2 to 3 pm yesterday", None),
+    ("from July 1 to July 20", ("2024-07-01", "2024-07-15")),
+    ("between July 10 and 2024-07-12", ("2024-07-10", "2024-07-12")),
+    ("since July 10", ("2024-07-10", "2024-07-15")),
+    ("past 24 months", ("2023-07-16", "2024-07-15")),
+]
+
+
+def test_month_words():
+    for text, expected in CASES:
+        got = extract_date(text, today=TODAY)
+        assert got == expected, f"{text!r}: expected {expected}, got {got}"
+        print(f"OK  {text!r} -> {got}")
+
+
+def test_no_date_hint():
+    for text in NO_HINT:
+        assert not _DATE_HINT.search(text), f"{text!r} would go to the dateparser fallback"
+        print(f"OK  {text!r} skips dateparser")
+    assert _DATE_HINT.search("back in Dec. we met") and _DATE_HINT.search("a few weeks back")
+
+
+def test_number_ranges():
+    for text, expected in RANGE_CASES:
+        got = extract_date_range(text, today=TODAY)
+        assert got == expected, f"{text!r}: expected {expected}, got {got}"
+        print(f"OK  {text!r} -> {got}")
+
+
+if __name__ == "__main__":
+    test_month_words()
+    test_no_date_hint()
+    test_number_ranges()
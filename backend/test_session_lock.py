@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Regression checks for the SQLite session lease: a streamed symptom turn whose client
+disconnects must still release the user's lease, and a lease left by an abandoned turn in
+this process must not make the user's next turn wait for it to expire.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import agent
+from session_store import SQLiteSessionStore
+
+USER_ID = "user_mary"
+MESSAGE = "I feel dizzy today"
+
+
+def make_store():
+    store = SQLiteSessionStore(agent.new_user_memory, os.path.join(tempfile.mkdtemp(), "sessions.db"))
+    session = store.new_session()
+    session.greeted = True
+    store.save(USER_ID, session)
+    return store
+
+
+def leases(store):
+    return store._connect().execute("SELECT COUNT(*) FROM session_locks WHERE user_id = ?", (USER_ID,)).fetchone()[0]
+
+
+def wait_for_release(store, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while leases(store) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert leases(store) == 0, "lease still held after the client disconnected"
+    store.lock(USER_ID, timeout=1).release()
+
+
+class patched_agent:
+    """Swap in the temporary store and canned retrieval / agent output"""
+
+    def __init__(self, store):
+        self.values = {
+            "session_store": store,
+            "fetch_health_context": lambda user_id, date_str, *args, **kwargs: {
+                "food": "oatmeal", "vitals": "heart rate 72 bpm", "medical_record": "no new entries",
+            },
+            "run_agent": lambda turn, callbacks=None: "Please sit down and drink some water.",
+            "arun_agent": self.arun_agent,
+        }
+
+    @staticmethod
+    async def arun_agent(turn, callbacks=None):
+        await asyncio.sleep(0.05)
+        return "Please sit down and drink some water."
+
+    def __enter__(self):
+        self.saved = {name: getattr(agent, name) for name in self.values}
+        for name, value in self.values.items():
+            setattr(agent, name, value)
+
+    def __exit__(self, *exc_info):
+        for name, value in self.saved.items():
+            setattr(agent, name, value)
+
+
+def test_stream_disconnect_releases_lease():
+    store = make_store()
+    with patched_agent(store):
+        stream = agent.agent_response_stream(MESSAGE, USER_ID)
+        first = next(stream)
+        assert first["event"] == "token" and first["text"].startswith("Based on your records"), first
+        stream.close()  # the client went away at the symptom facts
+        wait_for_release(store)
+    print("OK  sync stream")
+
+
+def test_astream_disconnect_releases_lease():
+    store = make_store()
+
+    async def run():
+        stream = agent.agent_response_astream(MESSAGE, USER_ID)
+        first = await stream.__anext__()
+        assert first["event"] == "token", first
+        await stream.aclose()
+        await asyncio.gather(*agent._unfinished_turns)
+
+    with patched_agent(store):
+        asyncio.run(run())
+        wait_for_release(store)
+    print("OK  async stream")
+
+
+def test_abandoned_lease_taken_over():
+    store = make_store()
+    lock = store.lock(USER_ID)
+    store._held.clear()  # as if the turn holding it had been dropped without releasing it
+    started = time.monotonic()
+    store.lock(USER_ID, timeout=5).release()
+    assert time.monotonic() - started < 1, "waited for an abandoned lease"
+    lock.release()
+    print("OK  abandoned lease")
+
+
+if __name__ == "__main__":
+    test_stream_disconnect_releases_lease()
+    test_astream_disconnect_releases_lease()
+    test_abandoned_lease_taken_over()
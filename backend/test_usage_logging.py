@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Checks that streamed agent calls still report cached prompt tokens.
+
+UsageReportingChatOpenAI reads them from the raw OpenAI stream because langchain-openai
+0.1.x drops them; this fails if an openai or langchain-openai upgrade changes how the
+client is called or how the stream is read.
+"""
+
+import asyncio
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from openai.types.chat import ChatCompletionChunk
+
+from agent import PromptUsageLogger, UsageReportingChatOpenAI
+
+USAGE = {"prompt_tokens": 1500, "completion_tokens": 2, "total_tokens": 1502, "prompt_tokens_details": {"cached_tokens": 1280}}
+
+
+def fake_chunks():
+    base = dict(id="test", created=int(time.time()), model="gpt-4o-mini", object="chat.completion.chunk")
+    return [
+        ChatCompletionChunk(**base, choices=[{"index": 0, "delta": {"role": "assistant", "content": "Hello"}, "finish_reason": None}]),
+        ChatCompletionChunk(**base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]),
+        ChatCompletionChunk(**base, choices=[], usage=USAGE),
+    ]
+
+
+class FakeStream:
+    def __init__(self):
+        self.chunks = fake_chunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeCompletions:
+    def create(self, **payload):
+        assert payload["stream"] and payload["stream_options"] == {"include_usage": True}
+        return FakeStream()
+
+
+class FakeAsyncCompletions:
+    async def create(self, **payload):
+        assert payload["stream"] and payload["stream_options"] == {"include_usage": True}
+        return FakeStream()
+
+
+def make_llm():
+    llm = UsageReportingChatOpenAI(model="gpt-4o-mini")
+    assert hasattr(llm.client, "_completions"), "OpenAI client was not wrapped"
+    llm.client._completions = FakeCompletions()
+    llm.async_client._completions = FakeAsyncCompletions()
+    return llm.bind(stream_usage=True)
+
+
+def check(logger):
+    assert (logger.prompt_tokens, logger.cached_tokens, logger.completion_tokens) == (1500, 1280, 2), logger.summary()
+    print(f"OK  {logger.summary()}")
+
+
+def test_streamed_usage():
+    logger = PromptUsageLogger("test")
+    list(make_llm().stream("hi", config={"callbacks": [logger]}))
+    check(logger)
+
+
+def test_async_streamed_usage():
+    logger = PromptUsageLogger("test")
+
+    async def run():
+        async for _ in make_llm().astream("hi", config={"callbacks": [logger]}):
+            pass
+
+    asyncio.run(run())
+    check(logger)
+
+
+if __name__ == "__main__":
+    test_streamed_usage()
+    test_async_streamed_usage()
@@ -0,0 +1,351 @@
+import datetime
+import os
+import re
+import threading
+import warnings
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+VITALS_STORE_PATH = os.environ.get("VITALS_STORE_PATH", "vitals_store")
+
+# Column order of every per-user values matrix
+VITAL_FIELDS = ("heart_rate", "systolic", "diastolic", "spo2", "steps")
+
+VITAL_LABELS = {
+    "heart_rate": ("Heart rate", "bpm"),
+    "systolic": ("Systolic BP", "mmHg"),
+    "diastolic": ("Diastolic BP", "mmHg"),
+    "spo2": ("Oxygen saturation", "%"),
+    "steps": ("Step count", "steps"),
+}
+# Normal (low, high) bounds used for "days out of range"; None means unbounded on that side
+NORMAL_RANGES = {
+    "heart_rate": (60, 100),
+    "systolic": (90, 139),
+    "diastolic": (60, 89),
+    "spo2": (95, None),
+    "steps": (None, None),
+}
+TREND_WINDOWS = (7, 30)
+# Last axis of every precomputed trend array
+TREND_STATS = ("mean", "min", "max", "slope", "days_out_of_range", "days")
+
+_VITAL_PATTERNS = {
+    "heart_rate": re.compile(r"heart\s*rate\s*:?\s*(\d+(?:\.\d+)?)", re.IGNORECASE),
+    "blood_pressure": re.compile(r"blood\s*pressure\s*:?\s*(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)", re.IGNORECASE),
+    "spo2": re.compile(r"oxygen\s*saturation\s*:?\s*(\d+(?:\.\d+)?)", re.IGNORECASE),
+    "steps": re.compile(r"step\s*count\s*:?\s*(\d+(?:,\d{3})*)", re.IGNORECASE),
+}
+
+
+def parse_vitals(text: str) -> Dict[str, float]:
+    """Pull numeric vitals out of a record like "Heart rate: 125 bpm. Blood pressure: 140/89. ..." """
+    values = {}
+    match = _VITAL_PATTERNS["heart_rate"].search(text)
+    if match:
+        values["heart_rate"] = float(match.group(1))
+    match = _VITAL_PATTERNS["blood_pressure"].search(text)
+    if match:
+        values["systolic"] = float(match.group(1))
+        values["diastolic"] = float(match.group(2))
+    match = _VITAL_PATTERNS["spo2"].search(text)
+    if match:
+        values["spo2"] = float(match.group(1))
+    match = _VITAL_PATTERNS["steps"].search(text)
+    if match:
+        values["steps"] = float(match.group(1).replace(",", ""))
+    return values
+
+
+def day_ordinal(date_str: str) -> int:
+    return datetime.date.fromisoformat(date_str).toordinal()
+
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.1f}"
+
+
+def format_vitals(values: Dict[str, float]) -> str:
+    """Render vitals the same way the source records phrase them"""
+    parts = []
+    if "heart_rate" in values:
+        parts.append(f"Heart rate: {_num(values['heart_rate'])} bpm.")
+    if "systolic" in values and "diastolic" in values:
+        parts.append(f"Blood pressure: {_num(values['systolic'])}/{_num(values['diastolic'])}.")
+    if "spo2" in values:
+        parts.append(f"Oxygen saturation: {_num(values['spo2'])}%.")
+    if "steps" in values:
+        parts.append(f"Step count: {_num(values['steps'])}.")
+    return " ".join(parts)
+
+
+def _out_of_range(values: np.ndarray) -> np.ndarray:
+    """Boolean matrix, True where a measurement falls outside NORMAL_RANGES"""
+    low = np.array([NORMAL_RANGES[f][0] if NORMAL_RANGES[f][0] is not None else -np.inf for f in VITAL_FIELDS], dtype=np.float32)
+    high = np.array([NORMAL_RANGES[f][1] if NORMAL_RANGES[f][1] is not None else np.inf for f in VITAL_FIELDS], dtype=np.float32)
+    with np.errstate(invalid="ignore"):
+        return (values < low) | (values > high)
+
+
+def window_stats(ordinals: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """TREND_STATS for each field over one window of days; shape (len(VITAL_FIELDS), len(TREND_STATS)).
+
+    Slope is the least-squares change per day and needs at least two measurements.
+    """
+    present = ~np.isnan(values)
+    days = present.sum(axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(values, axis=0) if len(values) else np.full(len(VITAL_FIELDS), np.nan)
+        low = np.nanmin(values, axis=0) if len(values) else np.full(len(VITAL_FIELDS), np.nan)
+        high = np.nanmax(values, axis=0) if len(values) else np.full(len(VITAL_FIELDS), np.nan)
+    slope = np.full(len(VITAL_FIELDS), np.nan)
+    x = ordinals.astype(np.float64)
+    for col in range(len(VITAL_FIELDS)):
+        mask = present[:, col]
+        if mask.sum() >= 2:
+            xs = x[mask] - x[mask].mean()
+            denom = (xs * xs).sum()
+            if denom > 0:
+                slope[col] = (xs * (values[mask, col] - values[mask, col].mean())).sum() / denom
+    out = _out_of_range(values).sum(axis=0)
+    return np.stack([mean, low, high, slope, out, days], axis=1).astype(np.float32)
+
+
+class UserVitals:
+    """One resident's vitals as columns: sorted day ordinals and an (n_days, len(VITAL_FIELDS)) float32 matrix.
+
+    Missing measurements are NaN. Rolling stats for each TREND_WINDOWS size are kept per
+    day in `trends[window]`, an (n_days, len(VITAL_FIELDS), len(TREND_STATS)) array for the
+    window ending on that day. Inserting a day only marks it changed; refresh_trends()
+    then recomputes just the rows whose windows cover a changed day.
+    """
+
+    def __init__(self, ordinals: np.ndarray = None, values: np.ndarray = None, trends: Dict[int, np.ndarray] = None):
+        self.ordinals = ordinals if ordinals is not None else np.empty(0, dtype=np.int32)
+        self.values = values if values is not None else np.empty((0, len(VITAL_FIELDS)), dtype=np.float32)
+        self.trends = {}
+        self._changed = set()
+        for window in TREND_WINDOWS:
+            if trends and window in trends and len(trends[window]) == len(self.ordinals):
+                self.trends[window] = trends[window]
+            else:
+                # Older files without precomputed trends: compute them all once
+                self.trends[window] = np.full((len(self.ordinals), len(VITAL_FIELDS), len(TREND_STATS)), np.nan, dtype=np.float32)
+                self._changed.update(int(o) for o in self.ordinals)
+
+    def upsert(self, ordinal: int, row: np.ndarray):
+        pos = int(np.searchsorted(self.ordinals, ordinal))
+        if pos < len(self.ordinals) and self.ordinals[pos] == ordinal:
+            self.values[pos] = row
+        else:
+            self.ordinals = np.insert(self.ordinals, pos, ordinal)
+            self.values = np.insert(self.values, pos, row, axis=0)
+            for window in TREND_WINDOWS:
+                self.trends[window] = np.insert(self.trends[window], pos, np.nan, axis=0)
+        self._changed.add(int(ordinal))
+
+    def remove(self, ordinal: int) -> bool:
+        """Drop a day; the days after it whose windows covered it get their trends recomputed"""
+        pos = int(np.searchsorted(self.ordinals, ordinal))
+        if pos == len(self.ordinals) or self.ordinals[pos] != ordinal:
+            return False
+        self.ordinals = np.delete(self.ordinals, pos)
+        self.values = np.delete(self.values, pos, axis=0)
+        for window in TREND_WINDOWS:
+            self.trends[window] = np.delete(self.trends[window], pos, axis=0)
+        self._changed.add(int(ordinal))
+        return True
+
+    def refresh_trends(self):
+        """Recompute rolling stats for every day whose window contains a changed day"""
+        if not self._changed:
+            return
+        changed = np.array(sorted(self._changed), dtype=np.int64)
+        for window in TREND_WINDOWS:
+            affected = np.zeros(len(self.ordinals), dtype=bool)
+            starts = np.searchsorted(self.ordinals, changed, side="left")
+            ends = np.searchsorted(self.ordinals, changed + window - 1, side="right")
+            for lo, hi in zip(starts, ends):
+                affected[lo:hi] = True
+            for i in np.flatnonzero(affected):
+                ords, vals = self.window(int(self.ordinals[i]) - window + 1, int(self.ordinals[i]))
+                self.trends[window][i] = window_stats(ords, vals)
+        self._changed.clear()
+
+    def trend(self, window: int, end_ordinal: int) -> np.ndarray:
+        """Stats for the window ending on end_ordinal; precomputed when that day has a record"""
+        self.refresh_trends()
+        pos = int(np.searchsorted(self.ordinals, end_ordinal))
+        if pos < len(self.ordinals) and self.ordinals[pos] == end_ordinal and window in self.trends:
+            return self.trends[window][pos]
+        return window_stats(*self.window(end_ordinal - window + 1, end_ordinal))
+
+    def day(self, ordinal: int) -> Optional[np.ndarray]:
+        pos = int(np.searchsorted(self.ordinals, ordinal))
+        if pos < len(self.ordinals) and self.ordinals[pos] == ordinal:
+            return self.values[pos]
+        return None
+
+    def window(self, start_ordinal: int, end_ordinal: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Days and values with start <= ordinal <= end"""
+        lo = int(np.searchsorted(self.ordinals, start_ordinal, side="left"))
+        hi = int(np.searchsorted(self.ordinals, end_ordinal, side="right"))
+        return self.ordinals[lo:hi], self.values[lo:hi]
+
+
+class VitalsStore:
+    """Per-user columnar vitals time series, persisted as one .npz file per user.
+
+    Rolling 7- and 30-day trend stats are maintained at flush time and saved alongside,
+    so get_trends() is a lookup rather than a recomputation.
+    Ingestion calls record() for every vitals record, delete_day() for every vitals record
+    it deletes, and flush() when done. Readers
+    reload a user's file when its mtime changes, so another process's ingestion is seen
+    on the next lookup.
+    """
+
+    def __init__(self, path: str = VITALS_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._users: Dict[str, UserVitals] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._dirty = set()
+
+    def _file(self, user_id: str) -> str:
+        return os.path.join(self.path, f"{user_id}.npz")
+
+    def _user(self, user_id: str) -> UserVitals:
+        """Load (or reload, if the file changed on disk) a user's series; caller holds the lock"""
+        path = self._file(user_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if user_id in self._users and (user_id in self._dirty or self._mtimes.get(user_id) == mtime):
+            return self._users[user_id]
+        if mtime is None:
+            series = UserVitals()
+        else:
+            with np.load(path) as data:
+                trends = {w: data[f"trend_{w}"] for w in TREND_WINDOWS if f"trend_{w}" in data.files}
+                series = UserVitals(data["ordinals"], data["values"], trends)
+        self._users[user_id] = series
+        self._mtimes[user_id] = mtime
+        return series
+
+    def record(self, user_id: str, date_str: str, text: str) -> bool:
+        """Parse a vitals record and store it for that day; returns False if nothing numeric was found"""
+        values = parse_vitals(text)
+        if not values:
+            return False
+        row = np.array([values.get(field, np.nan) for field in VITAL_FIELDS], dtype=np.float32)
+        with self._lock:
+            self._user(user_id).upsert(day_ordinal(date_str), row)
+            self._dirty.add(user_id)
+        return True
+
+    def delete_day(self, user_id: str, date_str: str) -> bool:
+        """Forget a day's vitals (e.g. its record was deleted); returns False if there was none"""
+        with self._lock:
+            removed = self._user(user_id).remove(day_ordinal(date_str))
+            if removed:
+                self._dirty.add(user_id)
+        return removed
+
+    def flush(self):
+        """Write every user changed since the last flush"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            for user_id in self._dirty:
+                series = self._users[user_id]
+                series.refresh_trends()
+                tmp = self._file(user_id) + ".tmp.npz"
+                np.savez(
+                    tmp, ordinals=series.ordinals, values=series.values,
+                    **{f"trend_{w}": series.trends[w] for w in TREND_WINDOWS}
+                )
+                os.replace(tmp, self._file(user_id))
+                self._mtimes[user_id] = os.path.getmtime(self._file(user_id))
+            self._dirty.clear()
+
+    def get_day(self, user_id: str, date_str: str) -> Optional[Dict[str, float]]:
+        """Vitals for one day as {field: value}, or None if the day has no record"""
+        with self._lock:
+            row = self._user(user_id).day(day_ordinal(date_str))
+            row = None if row is None else row.copy()
+        if row is None:
+            return None
+        return {field: float(value) for field, value in zip(VITAL_FIELDS, row) if not np.isnan(value)}
+
+    def get_range(self, user_id: str, start_date: str, end_date: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(ordinals, values) for start_date..end_date inclusive"""
+        with self._lock:
+            ordinals, values = self._user(user_id).window(day_ordinal(start_date), day_ordinal(end_date))
+            return ordinals.copy(), values.copy()
+
+    def describe_day(self, user_id: str, date_str: str) -> Optional[str]:
+        values = self.get_day(user_id, date_str)
+        return format_vitals(values) if values else None
+
+    def describe_range(self, user_id: str, start_date: str, end_date: str) -> Optional[str]:
+        """One "YYYY-MM-DD: ..." line per recorded day in the range"""
+        ordinals, values = self.get_range(user_id, start_date, end_date)
+        lines = []
+        for ordinal, row in zip(ordinals, values):
+            day_values = {field: float(value) for field, value in zip(VITAL_FIELDS, row) if not np.isnan(value)}
+            lines.append(f"{datetime.date.fromordinal(int(ordinal)).isoformat()}: {format_vitals(day_values)}")
+        return "\n".join(lines) if lines else None
+
+    def latest_date(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            ordinals = self._user(user_id).ordinals
+            return datetime.date.fromordinal(int(ordinals[-1])).isoformat() if len(ordinals) else None
+
+    def get_trends(self, user_id: str, end_date: str = None, windows: Iterable[int] = TREND_WINDOWS) -> Dict[int, Dict[str, Dict[str, float]]]:
+        """Rolling stats per window and vital: {window: {field: {stat: value}}}.
+
+        end_date defaults to the most recent recorded day. Fields with no measurements in a
+        window are left out.
+        """
+        end_date = end_date or self.latest_date(user_id)
+        if not end_date:
+            return {}
+        end_ordinal = day_ordinal(end_date)
+        result = {}
+        with self._lock:
+            series = self._user(user_id)
+            for window in windows:
+                stats = series.trend(window, end_ordinal)
+                result[window] = {
+                    field: {stat: float(value) for stat, value in zip(TREND_STATS, stats[col])}
+                    for col, field in enumerate(VITAL_FIELDS)
+                    if stats[col][TREND_STATS.index("days")] > 0
+                }
+        return result
+
+    def describe_trends(self, user_id: str, end_date: str = None) -> Optional[str]:
+        """Short text summary of the 7- and 30-day trends, for prompt context"""
+        end_date = end_date or self.latest_date(user_id)
+        trends = self.get_trends(user_id, end_date)
+        if not any(trends.values()):
+            return None
+        lines = []
+        for window, fields in trends.items():
+            if not fields:
+                continue
+            parts = []
+            for field, stats in fields.items():
+                label, unit = VITAL_LABELS[field]
+                part = f"{label} avg {_num(round(stats['mean'], 1))} {unit} (range {_num(stats['min'])}-{_num(stats['max'])})"
+                if not np.isnan(stats["slope"]):
+                    part += f", {'rising' if stats['slope'] > 0 else 'falling' if stats['slope'] < 0 else 'flat'} {abs(stats['slope']):.1f}/day"
+                if NORMAL_RANGES[field] != (None, None):
+                    part += f", {int(stats['days_out_of_range'])}/{int(stats['days'])} days out of range"
+                parts.append(part)
+            lines.append(f"{window}-day trend ending {end_date}: " + "; ".join(parts) + ".")
+        return "\n".join(lines)
+
+
+vitals_store = VitalsStore()
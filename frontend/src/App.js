@@ -23,10 +23,52 @@ function TypingAnimation() {
   );
 }
 
+// Posts to /chat/stream and reads its Server-Sent Events. Calls onText with the reply
+// so far on every token and resolves with the final (post-processed) reply.
+async function streamChat(body, onText) {
+  const res = await fetch("/chat/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok || !res.body) throw new Error(`Streaming request failed: ${res.status}`);
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      let data = "";
+      raw.split("\n").forEach(line => {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      const payload = data ? JSON.parse(data) : {};
+      if (event === "token") {
+        text += payload.text;
+        onText(text);
+      } else if (event === "final") {
+        return payload.response;
+      } else if (event === "error") {
+        throw new Error(payload.error);
+      }
+    }
+  }
+  return text;
+}
+
 function CareAssistantChat({ userId }) {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
+  const [replyStarted, setReplyStarted] = useState(false);
   const [recording, setRecording] = useState(false);
   const [transcribing, setTranscribing] = useState(false);
   const mediaRecorderRef = useRef(null);
@@ -51,6 +93,7 @@ function CareAssistantChat({ userId }) {
 
   useEffect(() => {
     if (!userId) return;
+    const addFollowup = text => setMessages(msgs => [...msgs, { sender: "agent", text }]);
     const checkFollowups = async () => {
       try {
         const res = await fetch("/check-followups", {
@@ -60,17 +103,35 @@ function CareAssistantChat({ userId }) {
         });
         const data = await res.json();
         if (data.followups && data.followups.length > 0) {
-          data.followups.forEach(followup => {
-            setMessages(msgs => [...msgs, { sender: "agent", text: followup }]);
-          });
+          data.followups.forEach(addFollowup);
         }
       } catch (error) {
         console.error("Error checking follow-ups:", error);
       }
     };
-    checkFollowups();
-    const interval = setInterval(checkFollowups, 10000);
-    return () => clearInterval(interval);
+    // Poll only while the push stream is unavailable
+    let interval = null;
+    const startPolling = () => {
+      if (interval) return;
+      checkFollowups();
+      interval = setInterval(checkFollowups, 10000);
+    };
+    const stopPolling = () => {
+      clearInterval(interval);
+      interval = null;
+    };
+    if (!window.EventSource) {
+      startPolling();
+      return stopPolling;
+    }
+    const source = new EventSource(`/followups/stream?user_id=${encodeURIComponent(userId)}`);
+    source.addEventListener("followup", e => addFollowup(JSON.parse(e.data).text));
+    source.onopen = stopPolling;
+    source.onerror = startPolling; // EventSource keeps retrying; onopen stops polling again
+    return () => {
+      source.close();
+      stopPolling();
+    };
   }, [userId]);
 
   useEffect(() => {
@@ -85,13 +146,40 @@ function CareAssistantChat({ userId }) {
     if (!input.trim()) return;
     setMessages(msgs => [...msgs, { sender: "user", text: input }]);
     setLoading(true);
-    const res = await fetch("/chat", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message: input, user_id: userId }),
-    });
-    const data = await res.json();
-    setMessages(msgs => [...msgs, { sender: "agent", text: data.response }]);
+    setReplyStarted(false);
+    // Show the reply as it streams in, updating one message in place
+    const replyId = Date.now();
+    let started = false;
+    const showText = text => {
+      if (!started) {
+        started = true;
+        setReplyStarted(true);
+        setMessages(msgs => [...msgs, { id: replyId, sender: "agent", text }]);
+      } else {
+        setMessages(msgs => msgs.map(msg => (msg.id === replyId ? { ...msg, text } : msg)));
+      }
+    };
+    try {
+      const reply = await streamChat({ message: input, user_id: userId }, showText);
+      showText(reply);
+    } catch (error) {
+      if (started) {
+        // Part of the reply was shown; re-sending could repeat the turn
+        console.error("Streaming failed:", error);
+        showText("Sorry, something went wrong. Please try again.");
+        setInput("");
+        setLoading(false);
+        return;
+      }
+      console.error("Streaming failed, falling back to /chat:", error);
+      const res = await fetch("/chat", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ message: input, user_id: userId }),
+      });
+      const data = await res.json();
+      showText(data.response);
+    }
     setInput("");
     setLoading(false);
   };
@@ -169,7 +257,7 @@ function CareAssistantChat({ userId }) {
               </div>
             </div>
           ))}
-          {loading && <TypingAnimation />}
+          {loading && !replyStarted && <TypingAnimation />}
           {recording && (
             <div className="recording-indicator">
               <span className="recording-dot"></span>